@@ -0,0 +1,171 @@
+"""Rolling, drain-aware stops of many agents.
+
+drain_agents() stops a set of agents without killing running jobs and
+without stopping a whole queue's worth of busy agents at once:
+
+1. Agents that are idle in the first snapshot are stopped straight away,
+   in concurrent batches.
+2. Busy agents are stopped gracefully ({'force': 'false'}), so they finish
+   their current job first, with at most max_draining_per_queue of them
+   draining per queue at any time.
+3. Progress is tracked with one list_agents() snapshot per poll, rather than
+   one get_agent() call per agent. As agents disconnect, the next busy
+   agents of their queue start draining.
+
+    report = drain_agents(buildkite_client, org_slug, match=lambda agent: "v3.1" in agent["version"])
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import requests
+
+from main import BuildkiteClient, BuildkiteError, _json
+
+logger = logging.getLogger(__name__)
+
+# Agents in these connection states have stopped and can be forgotten.
+STOPPED_CONNECTION_STATES = {"disconnected", "stopped", "lost", "never_connected"}
+
+
+def agent_queue(agent: dict) -> str:
+    """Returns the queue an agent serves, from its queue= tag."""
+    for tag in agent.get("meta_data") or []:
+        if tag.startswith("queue="):
+            return tag.split("=", 1)[1]
+    return "default"
+
+
+def is_busy(agent: dict) -> bool:
+    """Whether an agent is currently running a job."""
+    return agent.get("job") is not None
+
+
+def snapshot_agents(client: BuildkiteClient, org_slug: str) -> dict:
+    """Returns every connected agent of an organization, keyed by agent ID."""
+    first_page = client.list_agents(org_slug, params={"per_page": 100})
+    return {
+        agent["id"]: agent
+        for agent in client.iterate(first_page)
+        if agent.get("connection_state") not in STOPPED_CONNECTION_STATES
+    }
+
+
+def drain_agents(
+    client: BuildkiteClient,
+    org_slug: str,
+    agent_ids: list = None,
+    match: Callable = None,
+    max_draining_per_queue: int = 2,
+    batch_size: int = 10,
+    poll_interval: float = 10.0,
+    timeout: float = None,
+) -> dict:
+    """Stops agents, idle ones first, draining busy ones a few per queue at a time.
+
+    Args:
+        client: The client to call the Agents API with.
+
+        org_slug: The organization slug is a simplified version of the
+            organisation name. You can find this within the full details of
+            an organization using list_organizations().
+
+        agent_ids (OPTIONAL): The IDs of the agents to stop.
+
+        match (OPTIONAL): A function called with each agent that returns
+            whether to stop it. Used when agent_ids is not given; without
+            either, every agent is stopped.
+
+        max_draining_per_queue: How many busy agents of a queue may be
+            finishing their job before stopping at the same time.
+
+        batch_size: How many stop calls are made concurrently.
+
+        poll_interval: Seconds between snapshots while busy agents drain.
+
+        timeout (OPTIONAL): Give up waiting after this many seconds.
+
+    Returns:
+        dict: The IDs of the agents that "stopped", those still "remaining"
+            when the timeout was reached, and a "failed" mapping of agent ID
+            to the error from its stop call.
+    """
+    started = time.monotonic()
+    agents = snapshot_agents(client, org_slug)
+    if agent_ids is not None:
+        wanted = set(agent_ids)
+        targets = {agent_id: agent for agent_id, agent in agents.items() if agent_id in wanted}
+    elif match is not None:
+        targets = {agent_id: agent for agent_id, agent in agents.items() if match(agent)}
+    else:
+        targets = dict(agents)
+
+    report = {"stopped": [], "remaining": [], "failed": {}}
+    stopping = {}
+    waiting = {}
+    for agent_id, agent in targets.items():
+        waiting.setdefault(agent_queue(agent), []).append(agent_id)
+
+    def stop(agent_id):
+        try:
+            response = client.stop_agent(org_slug, agent_id, params={"force": "false"})
+            if not response.ok:
+                _json(response)
+        except (BuildkiteError, requests.RequestException) as error:
+            return agent_id, str(error)
+        return agent_id, None
+
+    with ThreadPoolExecutor(max_workers=batch_size) as executor:
+
+        def stop_all(agent_ids):
+            for agent_id, error in executor.map(stop, agent_ids):
+                queue = agent_queue(targets[agent_id])
+                if error is None:
+                    stopping[agent_id] = queue
+                else:
+                    logger.warning("Could not stop agent %s: %s", agent_id, error)
+                    report["failed"][agent_id] = error
+
+        while True:
+            # Stop idle agents, then start draining busy ones within budget.
+            to_stop = []
+            for queue, queued in waiting.items():
+                # Only stopped agents still running a job count as draining;
+                # idle ones just have not disconnected yet.
+                draining = sum(
+                    1
+                    for agent_id, stopping_queue in stopping.items()
+                    if stopping_queue == queue and is_busy(agents.get(agent_id, {}))
+                )
+                for agent_id in list(queued):
+                    agent = agents.get(agent_id)
+                    if agent is None:
+                        # Disconnected on its own.
+                        queued.remove(agent_id)
+                        report["stopped"].append(agent_id)
+                    elif not is_busy(agent):
+                        queued.remove(agent_id)
+                        to_stop.append(agent_id)
+                    elif draining < max_draining_per_queue:
+                        queued.remove(agent_id)
+                        to_stop.append(agent_id)
+                        draining += 1
+            if to_stop:
+                logger.info("Stopping %d agents.", len(to_stop))
+                stop_all(to_stop)
+
+            if not stopping and not any(waiting.values()):
+                return report
+            if timeout is not None and time.monotonic() - started > timeout:
+                report["remaining"] = list(stopping) + [
+                    agent_id for queued in waiting.values() for agent_id in queued
+                ]
+                return report
+
+            time.sleep(poll_interval)
+            agents = snapshot_agents(client, org_slug)
+            for agent_id in list(stopping):
+                if agent_id not in agents:
+                    del stopping[agent_id]
+                    report["stopped"].append(agent_id)
@@ -0,0 +1,586 @@
+"""Columnar aggregation over large numbers of builds and jobs.
+
+BuildTable and JobTable turn builds, as returned by the list_*_builds
+functions, into compact columns: timestamps as arrays of floats, and
+pipelines, branches, states and step keys as arrays of interned integer
+codes. Group-by aggregations then work on those arrays rather than on the
+original dictionaries, which keeps memory low and makes repeated queries
+cheap.
+
+    first_page = buildkite_client.list_organization_builds(org_slug, params={"per_page": 100})
+    builds = BuildTable.from_builds(buildkite_client.iterate(first_page))
+    builds.duration_percentiles(by=("pipeline", "branch"))
+
+    jobs = JobTable.from_builds(buildkite_client.iterate(first_page))
+    jobs.failure_rates(by=("pipeline", "step_key"))
+
+Where build wall time goes is analysed from job timestamps. critical_path()
+finds the chain of jobs that determined when a build finished, splitting it
+into time waiting for an agent, running, and between jobs, and
+build_parallelism() measures how much of the build ran in parallel. Tables
+created with critical_path=True keep these per row, so bottlenecks can be
+found across thousands of builds. tables_from_builds() fills both tables in
+one pass, analysing each build once:
+
+    builds, jobs = tables_from_builds(buildkite_client.iterate(first_page), critical_path=True)
+    builds.wall_time_breakdown(by=("pipeline",))
+    jobs.bottlenecks(by=("pipeline", "step_key"))
+
+Only the standard library is used, so columns are array.array objects.
+"""
+import math
+from abc import ABC, abstractmethod
+from array import array
+from datetime import datetime
+from itertools import groupby
+from typing import Iterable
+
+import requests
+
+FAILED_STATES = {"failed", "timed_out", "broken", "expired"}
+NAN = float("nan")
+
+
+class Interner:
+    """Maps repeated strings to small integer codes, and back."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __call__(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+def parse_timestamp(value: str) -> float:
+    """Converts an ISO 8601 API timestamp to a POSIX timestamp, or NaN."""
+    if not value:
+        return NAN
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def iter_builds(source) -> Iterable:
+    """Yields decoded builds from the output of the list_*_builds functions.
+
+    Args:
+        source: A requests.Response, a list of builds, or any iterable of
+            builds or responses, such as BuildkiteClient.iterate() or
+            BuildkiteClient.paginate().
+    """
+    if isinstance(source, requests.Response):
+        yield from source.json()
+        return
+    for item in source:
+        if isinstance(item, requests.Response):
+            yield from item.json()
+        else:
+            yield item
+
+
+def percentile(values: list, q: float) -> float:
+    """Returns the q-th percentile of sorted values, interpolating linearly."""
+    if not values:
+        return NAN
+    position = (len(values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _job_runnable_at(job: dict) -> float:
+    """Returns when a job could first have started, had an agent been free."""
+    runnable = parse_timestamp(job.get("runnable_at"))
+    if runnable != runnable:
+        runnable = parse_timestamp(job.get("scheduled_at"))
+    return runnable
+
+
+def _finished_jobs(build: dict) -> list:
+    """Returns the jobs that ran to completion, in order, split by wait steps.
+
+    Block steps ("manual" jobs) wait for the jobs before them too, so they
+    split the build like wait steps.
+
+    Returns:
+        list: Lists of (job, runnable_at, started_at, finished_at), one list
+            per wait or block step separated section of the build.
+    """
+    sections = [[]]
+    for job in build.get("jobs") or []:
+        if job.get("type") in ("waiter", "manual"):
+            if sections[-1]:
+                sections.append([])
+            continue
+        if job.get("type") not in ("script", "trigger") or job.get("retried"):
+            continue
+        started = parse_timestamp(job.get("started_at"))
+        finished = parse_timestamp(job.get("finished_at"))
+        if started != started or finished != finished:
+            continue
+        runnable = _job_runnable_at(job)
+        if runnable != runnable or runnable > started:
+            runnable = started
+        sections[-1].append((job, runnable, started, finished))
+    return [section for section in sections if section]
+
+
+def critical_path(build: dict) -> list:
+    """Returns the chain of jobs that determined when a build finished.
+
+    Starting from the job that finished last, each job's predecessor is the
+    job it depended on that finished last before it became runnable. Jobs
+    depend on every job before the preceding wait or block step, and on the
+    steps named in their "depends_on", when present. Time spent waiting for a
+    block step to be unblocked shows up as the "gap" of the job after it:
+
+        build = {"created_at": "2024-01-01T00:00:00Z", "jobs": [
+            {"id": "a", "type": "script", "started_at": "2024-01-01T00:00:00Z",
+             "finished_at": "2024-01-01T00:01:00Z"},
+            {"type": "manual"},
+            {"id": "b", "type": "script", "runnable_at": "2024-01-01T00:11:00Z",
+             "started_at": "2024-01-01T00:11:00Z", "finished_at": "2024-01-01T00:12:00Z"},
+        ]}
+        [(step["job_id"], step["gap"]) for step in critical_path(build)]
+        # [("a", 0.0), ("b", 600.0)]
+
+    Args:
+        build: A decoded build, with its jobs.
+
+    Returns:
+        list: Dicts for each job on the path, in order, with its "job_id",
+            "step_key", "name", and in seconds: the "gap" between its
+            predecessor finishing (or the build being created) and it
+            becoming runnable, its "queue" wait for an agent, and its "run"
+            time.
+    """
+    return _critical_path(build, _finished_jobs(build))
+
+
+def _critical_path(build: dict, sections: list) -> list:
+    if not sections:
+        return []
+    by_key = {}
+    for section in sections:
+        for entry in section:
+            by_key[entry[0].get("step_key") or entry[0].get("id")] = entry
+
+    def dependencies(index, entry):
+        candidates = list(sections[index - 1]) if index > 0 else []
+        for key in entry[0].get("depends_on") or []:
+            if key in by_key:
+                candidates.append(by_key[key])
+        return candidates
+
+    section_of = {id(entry): index for index, section in enumerate(sections) for entry in section}
+    current = max((entry for section in sections for entry in section), key=lambda e: e[3])
+    chain = [current]
+    visited = {id(current)}
+    while True:
+        _, runnable, _, _ = current
+        # Allow a second of clock skew between a job finishing and the next
+        # one becoming runnable.
+        blocking = [
+            entry
+            for entry in dependencies(section_of[id(current)], current)
+            if entry[3] <= runnable + 1 and id(entry) not in visited
+        ]
+        if not blocking:
+            break
+        current = max(blocking, key=lambda entry: entry[3])
+        visited.add(id(current))
+        chain.append(current)
+    chain.reverse()
+
+    created = parse_timestamp(build.get("created_at"))
+    path = []
+    previous_finished = created if created == created else chain[0][1]
+    for job, runnable, started, finished in chain:
+        path.append(
+            {
+                "job_id": job.get("id"),
+                "step_key": job.get("step_key"),
+                "name": job.get("name"),
+                "gap": max(0.0, runnable - previous_finished),
+                "queue": started - runnable,
+                "run": finished - started,
+            }
+        )
+        previous_finished = finished
+    return path
+
+
+def build_parallelism(build: dict) -> dict:
+    """Returns how much of a build's work ran in parallel.
+
+    Returns:
+        dict: The build's "wall" time from the first job starting to the last
+            one finishing, the "busy" time summed over jobs, their
+            "average" and "peak" number running at once, and "utilisation",
+            the average as a share of the peak. NaN for builds without
+            finished jobs.
+    """
+    return _parallelism(_finished_jobs(build))
+
+
+def _parallelism(sections: list) -> dict:
+    entries = [entry for section in sections for entry in section]
+    if not entries:
+        return {"wall": NAN, "busy": NAN, "average": NAN, "peak": NAN, "utilisation": NAN}
+    events = sorted(
+        [(started, 1) for _, _, started, _ in entries]
+        + [(finished, -1) for _, _, _, finished in entries]
+    )
+    running = peak = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+    wall = events[-1][0] - events[0][0]
+    busy = sum(finished - started for _, _, started, finished in entries)
+    average = busy / wall if wall > 0 else float(peak)
+    return {
+        "wall": wall,
+        "busy": busy,
+        "average": average,
+        "peak": peak,
+        "utilisation": average / peak if peak else NAN,
+    }
+
+
+def _analyse(build: dict) -> tuple:
+    """Returns the critical_path() and build_parallelism() of a build."""
+    sections = _finished_jobs(build)
+    return _critical_path(build, sections), _parallelism(sections)
+
+
+def _mean(values: list) -> float:
+    values = [value for value in values if value == value]
+    return sum(values) / len(values) if values else NAN
+
+
+class _Table(ABC):
+    """The shared group-by machinery of BuildTable and JobTable."""
+
+    # The interned columns that can be grouped by.
+    dimensions = ()
+
+    def __init__(self, critical_path: bool = False):
+        """
+        Args:
+            critical_path: Also analyse the critical path of every build, and
+                record when jobs became runnable, for the methods that report
+                on queue time and the critical path. This costs far more than
+                the rest of the table, so it is off by default.
+        """
+        self.with_critical_path = critical_path
+        self.interners = {dimension: Interner() for dimension in self.dimensions}
+        self.columns = {dimension: array("l") for dimension in self.dimensions}
+        self.state = array("l")
+        self.states = Interner()
+        self.started_at = array("d")
+        self.finished_at = array("d")
+
+    def __len__(self):
+        return len(self.state)
+
+    @classmethod
+    def from_builds(cls, source, critical_path: bool = False):
+        """Creates a table from the output of the list_*_builds functions."""
+        table = cls(critical_path=critical_path)
+        table.extend(source)
+        return table
+
+    def extend(self, source):
+        """Appends builds from the output of the list_*_builds functions."""
+        for build in iter_builds(source):
+            self._append(build, _analyse(build) if self.with_critical_path else None)
+
+    @abstractmethod
+    def _append(self, build: dict, analysis: tuple = None):
+        """Appends the rows of one build, with its _analyse() result if any."""
+
+    def _require_critical_path(self, method: str):
+        if not self.with_critical_path:
+            raise ValueError(
+                f"{type(self).__name__}: {method}() needs a table created with critical_path=True."
+            )
+
+    def durations(self) -> array:
+        """Returns the run time of every row in seconds, NaN if unfinished."""
+        return array(
+            "d", (finished - started for started, finished in zip(self.started_at, self.finished_at))
+        )
+
+    def _groups(self, by: tuple, rows: Iterable = None):
+        """Yields (key, row indices) for each distinct combination of by."""
+        for dimension in by:
+            if dimension not in self.columns:
+                raise ValueError(
+                    f"{type(self).__name__}: cannot group by {dimension!r}, "
+                    f"expected one of {self.dimensions}."
+                )
+        codes = [self.columns[dimension] for dimension in by]
+        sizes = [len(self.interners[dimension]) for dimension in by]
+
+        # Fold the codes of every dimension into a single integer per row.
+        combined = array("q", [0]) * len(self)
+        for column, size in zip(codes, sizes):
+            combined = array("q", (key * size + code for key, code in zip(combined, column)))
+
+        indices = range(len(self)) if rows is None else rows
+        ordered = sorted(indices, key=combined.__getitem__)
+        for _, group in groupby(ordered, key=combined.__getitem__):
+            group = list(group)
+            first = group[0]
+            key = tuple(
+                self.interners[dimension].values[column[first]]
+                for dimension, column in zip(by, codes)
+            )
+            yield key, group
+
+    def duration_percentiles(
+        self, by: tuple = ("pipeline",), percentiles: tuple = (50, 90, 99)
+    ) -> dict:
+        """Returns duration percentiles, in seconds, of finished rows per group.
+
+        Args:
+            by: The dimensions to group by.
+
+            percentiles: The percentiles to compute.
+
+        Returns:
+            dict: For each group key, a dict of percentile to duration, plus
+                the "count" of finished rows.
+        """
+        durations = self.durations()
+        finished = [index for index, duration in enumerate(durations) if duration == duration]
+        result = {}
+        for key, rows in self._groups(by, finished):
+            values = sorted(durations[index] for index in rows)
+            result[key] = {q: percentile(values, q) for q in percentiles}
+            result[key]["count"] = len(values)
+        return result
+
+    def state_rates(self, states: set, by: tuple = ("pipeline",)) -> dict:
+        """Returns the fraction of rows per group whose state is in states."""
+        wanted = {self.states.codes[state] for state in states if state in self.states.codes}
+        result = {}
+        for key, rows in self._groups(by):
+            matching = sum(1 for index in rows if self.state[index] in wanted)
+            result[key] = matching / len(rows)
+        return result
+
+
+class BuildTable(_Table):
+    """Builds in columnar form, grouped by pipeline, branch or state."""
+
+    dimensions = ("pipeline", "branch", "state")
+
+    def __init__(self, critical_path: bool = False):
+        super().__init__(critical_path)
+        self.created_at = array("d")
+        self.number = array("l")
+        self.critical_gap = array("d")
+        self.critical_queue = array("d")
+        self.critical_run = array("d")
+        self.average_parallelism = array("d")
+        self.utilisation = array("d")
+        # State is both a value and a dimension; share the interner.
+        self.interners["state"] = self.states
+        self.columns["state"] = self.state
+
+    def _append(self, build: dict, analysis: tuple = None):
+        self.columns["pipeline"].append(
+            self.interners["pipeline"](build.get("pipeline", {}).get("slug", ""))
+        )
+        self.columns["branch"].append(self.interners["branch"](build.get("branch") or ""))
+        self.state.append(self.states(build.get("state") or ""))
+        self.number.append(build.get("number") or 0)
+        self.created_at.append(parse_timestamp(build.get("created_at")))
+        self.started_at.append(parse_timestamp(build.get("started_at")))
+        self.finished_at.append(parse_timestamp(build.get("finished_at")))
+        if analysis is None:
+            return
+        path, parallelism = analysis
+        if path:
+            self.critical_gap.append(sum(step["gap"] for step in path))
+            self.critical_queue.append(sum(step["queue"] for step in path))
+            self.critical_run.append(sum(step["run"] for step in path))
+        else:
+            self.critical_gap.append(NAN)
+            self.critical_queue.append(NAN)
+            self.critical_run.append(NAN)
+        self.average_parallelism.append(parallelism["average"])
+        self.utilisation.append(parallelism["utilisation"])
+
+    def wall_time_breakdown(self, by: tuple = ("pipeline",)) -> dict:
+        """Returns where the wall time of finished builds went, per group.
+
+        Returns:
+            dict: For each group key, the mean seconds per build of "wall"
+                time from creation to finishing, and of the critical path's
+                "queue" (waiting for agents), "run" and "gap" (between jobs,
+                for example waiting on block steps) time; the mean
+                "average_parallelism" and "utilisation"; and the "count" of
+                builds.
+
+        Raises:
+            ValueError: If the table was not created with critical_path=True.
+        """
+        self._require_critical_path("wall_time_breakdown")
+        finished_rows = [
+            index
+            for index, (created, finished) in enumerate(zip(self.created_at, self.finished_at))
+            if created == created and finished == finished
+        ]
+        result = {}
+        for key, rows in self._groups(by, finished_rows):
+            result[key] = {
+                "wall": _mean([self.finished_at[index] - self.created_at[index] for index in rows]),
+                "queue": _mean([self.critical_queue[index] for index in rows]),
+                "run": _mean([self.critical_run[index] for index in rows]),
+                "gap": _mean([self.critical_gap[index] for index in rows]),
+                "average_parallelism": _mean([self.average_parallelism[index] for index in rows]),
+                "utilisation": _mean([self.utilisation[index] for index in rows]),
+                "count": len(rows),
+            }
+        return result
+
+    def pass_rates(self, by: tuple = ("pipeline",)) -> dict:
+        """Returns the fraction of passed builds among finished ones per group."""
+        finished = {"passed"} | FAILED_STATES
+        codes = {self.states.codes[state] for state in finished if state in self.states.codes}
+        passed = self.states.codes.get("passed")
+        result = {}
+        finished_rows = [index for index, state in enumerate(self.state) if state in codes]
+        for key, rows in self._groups(by, finished_rows):
+            result[key] = sum(1 for index in rows if self.state[index] == passed) / len(rows)
+        return result
+
+
+class JobTable(_Table):
+    """Script jobs in columnar form, grouped by pipeline, branch or step key.
+
+    Jobs are identified by their step key, falling back to the step name for
+    steps without a key.
+    """
+
+    dimensions = ("pipeline", "branch", "step_key", "state")
+
+    def __init__(self, critical_path: bool = False):
+        super().__init__(critical_path)
+        self.build = array("l")
+        self.retried = array("b")
+        self.runnable_at = array("d")
+        self.critical = array("b")
+        self.interners["state"] = self.states
+        self.columns["state"] = self.state
+
+    def _append(self, build: dict, analysis: tuple = None):
+        pipeline_code = self.interners["pipeline"](build.get("pipeline", {}).get("slug", ""))
+        branch_code = self.interners["branch"](build.get("branch") or "")
+        step_key = self.interners["step_key"]
+        critical = {step["job_id"] for step in analysis[0]} if analysis is not None else None
+        for job in build.get("jobs", []):
+            if job.get("type") != "script":
+                continue
+            self.columns["pipeline"].append(pipeline_code)
+            self.columns["branch"].append(branch_code)
+            self.columns["step_key"].append(step_key(job.get("step_key") or job.get("name") or ""))
+            self.state.append(self.states(job.get("state") or ""))
+            self.build.append(build.get("number") or 0)
+            self.retried.append(bool(job.get("retried")))
+            self.started_at.append(parse_timestamp(job.get("started_at")))
+            self.finished_at.append(parse_timestamp(job.get("finished_at")))
+            if critical is not None:
+                self.runnable_at.append(_job_runnable_at(job))
+                self.critical.append(job.get("id") in critical)
+
+    def queue_waits(self) -> array:
+        """Returns how long every row waited for an agent, in seconds, NaN if unknown.
+
+        Raises:
+            ValueError: If the table was not created with critical_path=True.
+        """
+        self._require_critical_path("queue_waits")
+        return array(
+            "d", (started - runnable for runnable, started in zip(self.runnable_at, self.started_at))
+        )
+
+    def queue_percentiles(
+        self, by: tuple = ("pipeline", "step_key"), percentiles: tuple = (50, 90, 99)
+    ) -> dict:
+        """Returns percentiles of the time jobs waited for an agent, per group."""
+        waits = self.queue_waits()
+        known = [index for index, wait in enumerate(waits) if wait == wait]
+        result = {}
+        for key, rows in self._groups(by, known):
+            values = sorted(waits[index] for index in rows)
+            result[key] = {q: percentile(values, q) for q in percentiles}
+            result[key]["count"] = len(values)
+        return result
+
+    def bottlenecks(self, by: tuple = ("pipeline", "step_key"), top: int = 10) -> list:
+        """Returns the groups of jobs that cost the most critical path time.
+
+        Returns:
+            list: (key, stats) pairs, most critical path time first. Stats
+                are the total critical path "queue" and "run" seconds of the
+                group's jobs, their "total", the number of times a job of the
+                group was on the critical path ("critical_count") and the
+                "count" of its jobs.
+
+        Raises:
+            ValueError: If the table was not created with critical_path=True.
+        """
+        self._require_critical_path("bottlenecks")
+        waits = self.queue_waits()
+        durations = self.durations()
+        result = []
+        for key, rows in self._groups(by):
+            critical_rows = [index for index in rows if self.critical[index]]
+            queue = sum(waits[index] for index in critical_rows if waits[index] == waits[index])
+            run = sum(
+                durations[index] for index in critical_rows if durations[index] == durations[index]
+            )
+            stats = {
+                "queue": queue,
+                "run": run,
+                "total": queue + run,
+                "critical_count": len(critical_rows),
+                "count": len(rows),
+            }
+            result.append((key, stats))
+        result.sort(key=lambda item: item[1]["total"], reverse=True)
+        return result[:top]
+
+    def failure_rates(self, by: tuple = ("pipeline", "step_key")) -> dict:
+        """Returns the fraction of failed jobs per group."""
+        return self.state_rates(FAILED_STATES, by=by)
+
+
+def tables_from_builds(source, critical_path: bool = False) -> tuple:
+    """Creates a BuildTable and a JobTable together, in one pass over the builds.
+
+    Args:
+        source: The output of the list_*_builds functions.
+
+        critical_path: Also analyse the critical path of every build. Each
+            build is analysed once, for both tables.
+
+    Returns:
+        tuple: The BuildTable and the JobTable.
+    """
+    builds = BuildTable(critical_path=critical_path)
+    jobs = JobTable(critical_path=critical_path)
+    for build in iter_builds(source):
+        analysis = _analyse(build) if critical_path else None
+        builds._append(build, analysis)
+        jobs._append(build, analysis)
+    return builds, jobs
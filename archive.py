@@ -0,0 +1,324 @@
+"""Archives job logs into a deduplicated, compressed, content-addressed store.
+
+Consecutive builds of a pipeline produce logs that are almost identical, so
+LogArchive splits each log into content-defined chunks and stores every
+distinct chunk once, compressed, under the SHA-256 of its contents. A small
+manifest per log lists its chunks, so any log can be rebuilt by its job ID.
+
+Chunk boundaries are chosen at line ends, based on a hash of the line, so an
+inserted or removed line only changes the chunk around it. The timestamp
+markers Buildkite adds to log lines differ on every run; they are moved out
+of the chunks into the manifest, which lets the surrounding text deduplicate.
+
+    archive = LogArchive("log-archive")
+    archive.archive_job_log(buildkite_client, org_slug, "my-pipeline", "42", job_id, delete=True)
+    original = archive.get(job_id)
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import tempfile
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import requests
+
+from main import BuildkiteClient, BuildkiteError, _json
+
+# Job states after which a job's log will not grow any more.
+FINISHED_JOB_STATES = {
+    "passed", "failed", "canceled", "timed_out", "skipped", "broken", "expired", "finished",
+}
+
+_TIMESTAMP = re.compile(rb"\x1b_bk;t=(\d+)\x07")
+_TIMESTAMP_PLACEHOLDER = b"\x1b_bk;t=\x07"
+
+
+def _lines(stream: Iterable) -> Iterator[bytes]:
+    """Splits a stream of byte blocks into lines, keeping the line endings."""
+    pending = b""
+    for block in stream:
+        pending += block
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+class LogArchive:
+    """A local content-addressed store of compressed, deduplicated log chunks."""
+
+    def __init__(
+        self,
+        root: str,
+        average_chunk_size: int = 16384,
+        min_chunk_size: int = 2048,
+        max_chunk_size: int = 65536,
+        compression_level: int = 6,
+    ):
+        """
+        Args:
+            root: The directory to keep the archive in.
+
+            average_chunk_size: The chunk size, in bytes, to aim for.
+
+            min_chunk_size: No boundary is placed before a chunk is this big.
+
+            max_chunk_size: A boundary is forced once a chunk is this big.
+
+            compression_level: The zlib compression level of stored chunks.
+        """
+        self.root = root
+        self.__average = average_chunk_size
+        self.__min = min_chunk_size
+        self.__max = max_chunk_size
+        self.__level = compression_level
+        os.makedirs(os.path.join(root, "chunks"), exist_ok=True)
+        os.makedirs(os.path.join(root, "logs"), exist_ok=True)
+
+    def __chunk_path(self, digest: str) -> str:
+        return os.path.join(self.root, "chunks", digest[:2], digest)
+
+    def __manifest_path(self, log_id: str) -> str:
+        return os.path.join(self.root, "logs", f"{log_id}.json")
+
+    def __write_atomically(self, path: str, content: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, "wb") as temporary_file:
+            temporary_file.write(content)
+        os.replace(temporary, path)
+
+    def __chunks(self, lines: Iterable) -> Iterator[bytes]:
+        chunk = []
+        size = 0
+        for line in lines:
+            # Very long lines are cut so that no chunk exceeds the maximum.
+            while size + len(line) > self.__max:
+                cut = self.__max - size
+                chunk.append(line[:cut])
+                yield b"".join(chunk)
+                chunk, size, line = [], 0, line[cut:]
+            chunk.append(line)
+            size += len(line)
+            # A line ends a chunk with a probability proportional to its
+            # length, so chunks average out at average_chunk_size bytes.
+            if size >= self.__min and zlib.crc32(line) % self.__average < len(line):
+                yield b"".join(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield b"".join(chunk)
+
+    def __store_chunk(self, chunk: bytes) -> tuple:
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.__chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        compressed = zlib.compress(chunk, self.__level)
+        self.__write_atomically(path, compressed)
+        return digest, len(compressed)
+
+    def add(self, log_id: str, stream: Iterable, metadata: dict = None) -> dict:
+        """Archives a log.
+
+        Args:
+            log_id: The ID to store the log under, usually the job ID.
+
+            stream: The log as bytes, or as an iterable of byte blocks.
+
+            metadata (OPTIONAL): Extra details to keep in the log's manifest.
+
+        Returns:
+            dict: The "size" of the log, its number of "chunks", how many of
+                those were "new_chunks", and the compressed "stored_bytes"
+                they added to the archive.
+        """
+        if isinstance(stream, bytes):
+            stream = [stream]
+        timestamps = array("q")
+        keep_timestamps = True
+        size = 0
+
+        def normalised_lines():
+            nonlocal keep_timestamps, size
+            for line in _lines(stream):
+                size += len(line)
+                if keep_timestamps and _TIMESTAMP_PLACEHOLDER in line:
+                    # The placeholder occurs naturally, so extraction could
+                    # not be reversed; store the rest of the log verbatim.
+                    keep_timestamps = False
+                if keep_timestamps and b"\x1b_bk;t=" in line:
+                    timestamps.extend(int(value) for value in _TIMESTAMP.findall(line))
+                    line = _TIMESTAMP.sub(_TIMESTAMP_PLACEHOLDER, line)
+                yield line
+
+        manifest = {"id": log_id, "metadata": metadata or {}, "chunks": [], "size": 0}
+        stats = {"size": 0, "chunks": 0, "new_chunks": 0, "stored_bytes": 0}
+        for chunk in self.__chunks(normalised_lines()):
+            digest, stored = self.__store_chunk(chunk)
+            manifest["chunks"].append(digest)
+            stats["chunks"] += 1
+            stats["new_chunks"] += bool(stored)
+            stats["stored_bytes"] += stored
+
+        # Timestamps are stored as deltas, which compress to almost nothing.
+        deltas = array("q", (b - a for a, b in zip([0, *timestamps], timestamps)))
+        manifest["timestamps"] = base64.b64encode(zlib.compress(deltas.tobytes())).decode()
+        manifest["verbatim_from"] = None if keep_timestamps else len(timestamps)
+        manifest["size"] = stats["size"] = size
+        self.__write_atomically(
+            self.__manifest_path(log_id), json.dumps(manifest).encode("utf-8")
+        )
+        return stats
+
+    def iter_log(self, log_id) -> Iterator[bytes]:
+        """Yields an archived log back, chunk by chunk.
+
+        Args:
+            log_id: The ID the log was archived under, or its manifest.
+        """
+        manifest = log_id if isinstance(log_id, dict) else self.manifest(log_id)
+        deltas = array("q")
+        deltas.frombytes(zlib.decompress(base64.b64decode(manifest["timestamps"])))
+        remaining = iter(deltas)
+        timestamp = 0
+
+        def restore(match):
+            nonlocal timestamp
+            timestamp += next(remaining)
+            return b"\x1b_bk;t=%d\x07" % timestamp
+
+        # Placeholders are only restored up to the point extraction stopped.
+        limit = manifest.get("verbatim_from")
+        restored = 0
+        for digest in manifest["chunks"]:
+            with open(self.__chunk_path(digest), "rb") as chunk_file:
+                chunk = zlib.decompress(chunk_file.read())
+            if limit is None:
+                chunk = re.sub(re.escape(_TIMESTAMP_PLACEHOLDER), restore, chunk)
+            elif restored < limit:
+                count = min(limit - restored, chunk.count(_TIMESTAMP_PLACEHOLDER))
+                chunk = re.sub(re.escape(_TIMESTAMP_PLACEHOLDER), restore, chunk, count=count)
+                restored += count
+            yield chunk
+
+    def manifest(self, log_id: str) -> dict:
+        """Returns the manifest of an archived log."""
+        try:
+            with open(self.__manifest_path(log_id)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            raise BuildkiteError(f"LogArchive: no archived log {log_id}.")
+
+    def get(self, log_id: str) -> bytes:
+        """Returns an archived log, exactly as it was archived."""
+        return b"".join(self.iter_log(log_id))
+
+    def archive_job_log(
+        self,
+        client: BuildkiteClient,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        job_id: str,
+        delete: bool = False,
+    ) -> dict:
+        """Streams a job's log into the archive.
+
+        Args:
+            client: The client to fetch the log with.
+
+            org_slug: The organization slug is a simplified version of the
+                organisation name. You can find this within the full details of
+                an organization using list_organizations().
+
+            pipeline_slug: The pipeline slug is a simplified version of the
+                pipeline name. You can find this within the full details of a
+                pipeline using list_pipelines().
+
+            build_number: The number of the build the job belongs to.
+
+            job_id: All jobs have a unique ID. The log is archived under it.
+
+            delete: Call delete_job_log() once the log is safely archived.
+
+        Returns:
+            dict: The statistics returned by add().
+        """
+        response = client.get_job_log(
+            org_slug, pipeline_slug, build_number, job_id, stream=True
+        )
+        _check(response)
+        with response:
+            stats = self.add(
+                job_id,
+                response.iter_content(chunk_size=1 << 16),
+                metadata={
+                    "org": org_slug,
+                    "pipeline": pipeline_slug,
+                    "build_number": build_number,
+                },
+            )
+        if delete:
+            _check(client.delete_job_log(org_slug, pipeline_slug, build_number, job_id))
+        return stats
+
+    def archive_build_logs(
+        self,
+        client: BuildkiteClient,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        delete: bool = False,
+        max_workers: int = 8,
+    ) -> dict:
+        """Archives the logs of the finished script jobs of a build concurrently.
+
+        Jobs that are still running are skipped, so that a partial log is
+        never archived, let alone deleted. A job whose log cannot be archived
+        or deleted does not stop the others.
+
+        Returns:
+            dict: The statistics returned by add() for each "archived" job
+                ID, the IDs of the jobs "skipped" as unfinished, and a
+                "failed" mapping of job ID to error message.
+        """
+        build = _json(client.get_build(org_slug, pipeline_slug, build_number))
+        result = {"archived": {}, "skipped": [], "failed": {}}
+        job_ids = []
+        for job in build["jobs"]:
+            if job.get("type") != "script":
+                continue
+            if job.get("state") in FINISHED_JOB_STATES:
+                job_ids.append(job["id"])
+            else:
+                result["skipped"].append(job["id"])
+
+        def archive(job_id):
+            try:
+                return self.archive_job_log(
+                    client, org_slug, pipeline_slug, build_number, job_id, delete=delete
+                ), None
+            except (BuildkiteError, requests.RequestException) as error:
+                return None, str(error)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for job_id, (stats, error) in zip(job_ids, executor.map(archive, job_ids)):
+                if error is None:
+                    result["archived"][job_id] = stats
+                else:
+                    result["failed"][job_id] = error
+        return result
+
+
+def _check(response):
+    """Raises BuildkiteError for a failed call whose body is not needed."""
+    if not response.ok:
+        _json(response)
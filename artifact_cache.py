@@ -0,0 +1,304 @@
+"""A host-wide cache of downloaded artifacts, shared between processes.
+
+Artifacts are stored once per host, under their SHA-1 (the sha1sum the
+Artifacts API reports), so any number of processes asking for the same
+artifact download it once:
+
+    cache = ArtifactCache("/var/cache/buildkite-artifacts", max_bytes=50 << 30)
+    for artifact in buildkite_client.iterate(buildkite_client.list_build_artifacts(org_slug, "app", "42")):
+        path = cache.fetch(buildkite_client, org_slug, "app", "42", artifact)
+
+- A per-artifact file lock makes sure only one process downloads a given
+  artifact; the others wait for it and then use the cached copy.
+- Downloads are streamed to a temporary file, checked against the sha1sum,
+  made read-only for everyone, and moved into place atomically, so a partial
+  file is never visible.
+- open() memory-maps a cached artifact read-only, so consumers share the page
+  cache rather than each reading a private copy.
+- Once the cache is larger than max_bytes, the least recently used artifacts
+  are evicted. Memory maps that are already open stay valid.
+
+Several users of a host can share one cache: its directories are made
+writable by everyone, lock files are opened read-only, and artifacts are
+readable by everyone. Only share a cache between users that trust each
+other, since any of them can evict or replace its files.
+
+File locks use fcntl, so this module only works on POSIX systems.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from main import BuildkiteClient, BuildkiteError, _json
+
+_SHA1 = re.compile(r"[0-9a-f]{40}")
+
+
+def _shared_directory(path: str):
+    """Creates a directory that every user of the host may write to."""
+    os.makedirs(path, exist_ok=True)
+    try:
+        # makedirs() modes are masked by the umask, so set it explicitly.
+        os.chmod(path, 0o777)
+    except PermissionError:
+        # Created by another user, who made it shared already.
+        pass
+
+
+class ArtifactCache:
+    """A content-addressed, size-bounded artifact cache on the local disk."""
+
+    def __init__(self, root: str, max_bytes: int = 10 << 30):
+        """
+        Args:
+            root: The directory to keep the cache in. Every process using the
+                same directory shares the cache.
+
+            max_bytes: The size the cache is trimmed down to after a download.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        _shared_directory(root)
+        _shared_directory(os.path.join(root, "objects"))
+        _shared_directory(os.path.join(root, "locks"))
+
+    def path(self, sha1sum: str) -> str:
+        """Returns where the artifact with the given SHA-1 is, or would be, cached.
+
+        Raises:
+            BuildkiteError: If sha1sum is not a SHA-1 in lowercase hex, since it
+                is used as a file name.
+        """
+        if not isinstance(sha1sum, str) or not _SHA1.fullmatch(sha1sum):
+            raise BuildkiteError(f"ArtifactCache: invalid sha1sum {sha1sum!r}.")
+        return os.path.join(self.root, "objects", sha1sum[:2], sha1sum)
+
+    def __lock_file(self, name: str):
+        # Read-only, so that lock files created by another user can be used.
+        descriptor = os.open(
+            os.path.join(self.root, "locks", f"{name}.lock"), os.O_RDONLY | os.O_CREAT, 0o444
+        )
+        try:
+            # The mode given to os.open() is masked by the umask.
+            os.fchmod(descriptor, 0o444)
+        except PermissionError:
+            pass
+        return os.fdopen(descriptor, "rb")
+
+    @contextmanager
+    def __locked(self, name: str, operation: int):
+        with self.__lock_file(name) as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __hit(self, path: str) -> bool:
+        """Marks a cached artifact as recently used, if it is cached."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except PermissionError:
+            # Cached by another user; only its owner can update the time.
+            return True
+
+    def fetch(
+        self,
+        client: BuildkiteClient,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        artifact: dict,
+    ) -> str:
+        """Returns the path of a cached artifact, downloading it first if needed.
+
+        Args:
+            client: The client to download the artifact with.
+
+            org_slug: The organization slug is a simplified version of the
+                organisation name. You can find this within the full details of
+                an organization using list_organizations().
+
+            pipeline_slug: The pipeline slug is a simplified version of the
+                pipeline name. You can find this within the full details of a
+                pipeline using list_pipelines().
+
+            build_number: The number of the build the artifact belongs to.
+
+            artifact: The artifact, as returned by list_build_artifacts() or
+                get_artifact(). Its "sha1sum", "job_id" and "id" are used.
+
+        Returns:
+            str: The path of the cached file. Treat it as read-only; it may be
+                evicted later, so use open() or export() to keep using it.
+
+        Raises:
+            BuildkiteError: If the download failed, or its SHA-1 does not match.
+        """
+        sha1sum = artifact["sha1sum"]
+        path = self.path(sha1sum)
+        if self.__hit(path):
+            return path
+
+        with self.__locked(sha1sum, fcntl.LOCK_EX):
+            # Another process may have downloaded it while we waited.
+            if self.__hit(path):
+                return path
+            self.__download(client, org_slug, pipeline_slug, build_number, artifact, path)
+        self.evict(keep=sha1sum)
+        return path
+
+    def __download(self, client, org_slug, pipeline_slug, build_number, artifact, path):
+        response = client.download_artifact(
+            org_slug, pipeline_slug, build_number, artifact["job_id"], artifact["id"], stream=True
+        )
+        if not response.ok:
+            _json(response)
+
+        directory = os.path.dirname(path)
+        _shared_directory(directory)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".download-")
+        digest = hashlib.sha1()
+        try:
+            with response, os.fdopen(descriptor, "wb") as temporary_file:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    digest.update(chunk)
+                    temporary_file.write(chunk)
+            if digest.hexdigest() != artifact["sha1sum"]:
+                raise BuildkiteError(
+                    f"ArtifactCache: artifact {artifact['id']} downloaded with SHA-1 "
+                    f"{digest.hexdigest()}, expected {artifact['sha1sum']}."
+                )
+            # Exported copies may be hard links, so nothing may write to it.
+            os.chmod(temporary, 0o444)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def open(
+        self,
+        client: BuildkiteClient,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        artifact: dict,
+    ):
+        """Memory-maps an artifact read-only, downloading it first if needed.
+
+        Takes the same arguments as fetch().
+
+        Returns:
+            mmap.mmap: The artifact's contents. Close it when done, for example
+                by using it in a with block. Empty artifacts are returned as
+                an empty bytes object, since empty files cannot be mapped.
+        """
+        while True:
+            path = self.fetch(client, org_slug, pipeline_slug, build_number, artifact)
+            # Eviction takes the exclusive lock, so the file cannot be removed
+            # between being opened and mapped.
+            with self.__locked(artifact["sha1sum"], fcntl.LOCK_SH):
+                try:
+                    artifact_file = open(path, "rb")
+                except FileNotFoundError:
+                    continue
+            with artifact_file:
+                if os.fstat(artifact_file.fileno()).st_size == 0:
+                    return b""
+                return mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def export(
+        self,
+        client: BuildkiteClient,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        artifact: dict,
+        destination: str,
+    ) -> str:
+        """Puts a copy of an artifact at destination, downloading it first if needed.
+
+        The copy is a hard link to the cached file where possible, so it takes
+        no extra space, and a plain copy otherwise. Either way it survives the
+        artifact being evicted from the cache. A hard link shares the cached
+        file's read-only mode; to change the file, replace it rather than
+        writing to it in place.
+
+        Returns:
+            str: The destination.
+        """
+        path = self.fetch(client, org_slug, pipeline_slug, build_number, artifact)
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        if os.path.exists(destination):
+            os.unlink(destination)
+        with self.__locked(artifact["sha1sum"], fcntl.LOCK_SH):
+            try:
+                os.link(path, destination)
+            except OSError:
+                shutil.copyfile(path, destination)
+        return destination
+
+    def size(self) -> int:
+        """Returns the total size of the cached artifacts, in bytes."""
+        return sum(entry.stat().st_size for entry in self.__entries())
+
+    def __entries(self):
+        objects = os.path.join(self.root, "objects")
+        for prefix in os.scandir(objects):
+            if prefix.is_dir():
+                for entry in os.scandir(prefix.path):
+                    if _SHA1.fullmatch(entry.name):
+                        yield entry
+
+    def evict(self, keep: str = None) -> int:
+        """Removes the least recently used artifacts until the cache fits in max_bytes.
+
+        Artifacts that another process is downloading or opening are skipped.
+        Only one process evicts at a time; others return straight away.
+
+        Args:
+            keep (OPTIONAL): The SHA-1 of an artifact never to evict.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        with self.__lock_file("evict") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                entries = [(entry.stat(), entry) for entry in self.__entries()]
+                total = sum(stat.st_size for stat, _ in entries)
+                freed = 0
+                for stat, entry in sorted(entries, key=lambda item: item[0].st_mtime):
+                    if total - freed <= self.max_bytes:
+                        break
+                    if entry.name == keep:
+                        continue
+                    freed += self.__evict_one(entry.name, entry.path, stat.st_size)
+                return freed
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __evict_one(self, sha1sum: str, path: str, size: int) -> int:
+        with self.__lock_file(sha1sum) as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                os.unlink(path)
+                return size
+            except (FileNotFoundError, PermissionError):
+                return 0
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,231 @@
+"""Runs list_pipelines_with_builds() against a local stand-in GraphQL API.
+
+The stand-in serves an organization of --pipelines pipelines, each with
+builds of --jobs jobs, so builds with more than JOBS_PAGE_SIZE jobs exercise
+the aliased, batched RemainingJobs query. Only the two queries graphql_api.py
+sends are understood; they are told apart by operation name, and answered
+from their variables. Jobs are served as GraphQL reports them, FINISHED
+with a separate "passed" outcome. The run fails if any pipeline, build or
+job is missing or out of order, if a job's state is not the REST one (passed
+or failed), or if a build's "url" cannot be keyed like a REST build. It
+reports how many GraphQL requests were made, against the REST calls the same
+data would take.
+
+    python benchmarks/graphql_stand_in.py --pipelines 45 --jobs 250
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graphql_api import JOBS_PAGE_SIZE, list_pipelines_with_builds  # noqa: E402
+from main import BuildkiteClient  # noqa: E402
+from webhooks import _build_key  # noqa: E402
+
+
+def _connection(nodes: list, start: int, first: int) -> dict:
+    page = nodes[start : start + first]
+    return {
+        "pageInfo": {
+            "hasNextPage": start + first < len(nodes),
+            "endCursor": str(start + len(page)),
+        },
+        "edges": [{"node": node} for node in page],
+    }
+
+
+def _job(pipeline: int, build: int, index: int) -> dict:
+    return {
+        "__typename": "JobTypeCommand",
+        "id": f"job-{pipeline}-{build}-{index}",
+        "uuid": f"{pipeline}-{build}-{index}",
+        "label": f"step {index}",
+        "command": "make test",
+        # GraphQL reports finished jobs as FINISHED, and the outcome apart.
+        "state": "FINISHED",
+        "passed": index % 7 != 3,
+        "exitStatus": "0" if index % 7 != 3 else "1",
+        "scheduledAt": "2024-01-01T00:00:00Z",
+        "runnableAt": "2024-01-01T00:00:01Z",
+        "startedAt": "2024-01-01T00:00:02Z",
+        "finishedAt": "2024-01-01T00:00:09Z",
+        "step": {"key": f"step-{index}"},
+        "agent": {"uuid": "agent", "name": "agent-1"},
+    }
+
+
+class StandIn:
+    """The organization the stand-in serves."""
+
+    def __init__(self, pipelines: int, builds: int, jobs: int):
+        self.pipelines = pipelines
+        self.builds = builds
+        self.jobs = jobs
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def jobs_of(self, build_uuid: str) -> list:
+        pipeline, number = (int(part) for part in build_uuid.split("-"))
+        return [_job(pipeline, number, index) for index in range(self.jobs)]
+
+    def build(self, pipeline: int, number: int) -> dict:
+        uuid = f"{pipeline}-{number}"
+        return {
+            "id": f"build-{uuid}",
+            "uuid": uuid,
+            "number": number,
+            "state": "FAILED" if self.jobs > 3 else "PASSED",
+            "branch": "main",
+            "commit": "0" * 40,
+            "message": "Stand-in build",
+            "url": f"https://buildkite.com/acme/pipeline-{pipeline}/builds/{number}",
+            "createdAt": "2024-01-01T00:00:00Z",
+            "scheduledAt": "2024-01-01T00:00:00Z",
+            "startedAt": "2024-01-01T00:00:02Z",
+            "finishedAt": "2024-01-01T00:00:09Z",
+            "jobs": _connection(self.jobs_of(uuid), 0, JOBS_PAGE_SIZE),
+        }
+
+    def pipelines_with_builds(self, variables: dict) -> dict:
+        start = int(variables.get("after") or 0)
+        nodes = []
+        for pipeline in range(start, min(start + variables["first"], self.pipelines)):
+            builds = [
+                self.build(pipeline, number)
+                for number in range(self.builds, 0, -1)[: variables["builds"]]
+            ]
+            nodes.append(
+                {
+                    "id": f"pipeline-{pipeline}",
+                    "uuid": f"uuid-{pipeline}",
+                    "slug": f"pipeline-{pipeline}",
+                    "name": f"Pipeline {pipeline}",
+                    "description": None,
+                    "defaultBranch": "main",
+                    "url": f"https://buildkite.com/acme/pipeline-{pipeline}",
+                    "repository": {"url": "git@github.com:acme/app.git"},
+                    "builds": _connection(builds, 0, len(builds)),
+                }
+            )
+        connection = _connection(nodes, 0, len(nodes))
+        connection["pageInfo"] = {
+            "hasNextPage": start + len(nodes) < self.pipelines,
+            "endCursor": str(start + len(nodes)),
+        }
+        return {"organization": {"pipelines": connection}}
+
+    def remaining_jobs(self, variables: dict) -> dict:
+        data = {}
+        for name, build_uuid in variables.items():
+            if name.startswith("build"):
+                index = name[len("build") :]
+                start = int(variables[f"after{index}"] or 0)
+                data[f"b{index}"] = {
+                    "jobs": _connection(self.jobs_of(build_uuid), start, JOBS_PAGE_SIZE)
+                }
+        return data
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stand_in.lock:
+                    stand_in.requests += 1
+                if "query PipelinesWithBuilds" in request["query"]:
+                    data = stand_in.pipelines_with_builds(request["variables"])
+                elif "query RemainingJobs" in request["query"]:
+                    data = stand_in.remaining_jobs(request["variables"])
+                else:
+                    data = None
+                body = json.dumps(
+                    {"data": data}
+                    if data is not None
+                    else {"errors": [{"message": "Unknown query"}]}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def check(stand_in: StandIn, pipelines: list, builds_per_pipeline: int) -> list:
+    """Returns what is wrong with the fetched pipelines, if anything."""
+    problems = []
+    if [pipeline["slug"] for pipeline in pipelines] != [
+        f"pipeline-{index}" for index in range(stand_in.pipelines)
+    ]:
+        problems.append("pipelines are missing or out of order")
+    for index, pipeline in enumerate(pipelines):
+        numbers = [build["number"] for build in pipeline["builds"]]
+        expected = list(range(stand_in.builds, 0, -1))[:builds_per_pipeline]
+        if numbers != expected:
+            problems.append(f"{pipeline['slug']}: builds {numbers}, expected {expected}")
+        for build in pipeline["builds"]:
+            jobs = stand_in.jobs_of(build["id"])
+            if [job["id"] for job in build["jobs"]] != [job["uuid"] for job in jobs]:
+                problems.append(f"{pipeline['slug']} #{build['number']}: jobs incomplete")
+            elif [job["state"] for job in build["jobs"]] != [
+                "passed" if job["passed"] else "failed" for job in jobs
+            ]:
+                problems.append(f"{pipeline['slug']} #{build['number']}: wrong job states")
+            if _build_key(build) != ("acme", pipeline["slug"], build["number"]):
+                problems.append(f"{pipeline['slug']} #{build['number']}: bad url {build['url']}")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pipelines", type=int, default=45)
+    parser.add_argument("--builds-per-pipeline", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=250, help="jobs per build")
+    parser.add_argument("--page-size", type=int, default=20)
+    args = parser.parse_args()
+
+    stand_in = StandIn(args.pipelines, args.builds_per_pipeline + 2, args.jobs)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stand_in.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = BuildkiteClient(
+        "token", graphql_endpoint=f"http://127.0.0.1:{server.server_address[1]}/v1"
+    )
+    pipelines = list(
+        list_pipelines_with_builds(
+            client,
+            "acme",
+            builds_per_pipeline=args.builds_per_pipeline,
+            page_size=args.page_size,
+        )
+    )
+    client.close()
+    server.shutdown()
+
+    rest_calls = -(-args.pipelines // 100) + args.pipelines
+    print(
+        f"{len(pipelines)} pipelines, {args.builds_per_pipeline} builds each, "
+        f"{args.jobs} jobs per build: {stand_in.requests} GraphQL requests "
+        f"(about {rest_calls} REST calls)"
+    )
+    problems = check(stand_in, pipelines, args.builds_per_pipeline)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
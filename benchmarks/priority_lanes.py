@@ -0,0 +1,145 @@
+"""Measures interactive latency under background load, with and without priority lanes.
+
+A local mock API serves a fixed number of requests at a time, each taking
+--service-ms. Background threads crawl it as fast as the client allows,
+while one thread makes interactive calls. The run is repeated with every
+request at the same priority, and with the crawl marked "bulk" and the
+interactive calls marked "interactive". It reports the p50 and p99 latency
+of the interactive calls, and the crawl's throughput, for both.
+
+    python benchmarks/priority_lanes.py --background-threads 32
+
+The client's concurrency limit is pinned to --limit, unless --adaptive is
+given. Then the limit adapts, starting from --limit, and the final limit is
+reported too. With --interactive-service-ms the interactive endpoint can be
+made slower than the crawled one, to check that the difference is not taken
+for latency inflation:
+
+    python benchmarks/priority_lanes.py --adaptive --service-ms 20 --interactive-service-ms 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import percentile  # noqa: E402
+from main import AdaptiveConcurrencyLimit, BuildkiteClient, request_priority  # noqa: E402
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    capacity = None
+    service_time = None
+    interactive_service_time = None
+
+    def do_GET(self):
+        with self.capacity:
+            if self.path.endswith("/organizations/acme"):
+                time.sleep(self.interactive_service_time)
+            else:
+                time.sleep(self.service_time)
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(endpoint: str, args, lanes: bool) -> dict:
+    limit = args.limit
+    if args.adaptive:
+        concurrency = AdaptiveConcurrencyLimit(initial=limit, maximum=args.background_threads + 1)
+    else:
+        concurrency = AdaptiveConcurrencyLimit(initial=limit, minimum=limit, maximum=limit)
+    client = BuildkiteClient(
+        "token",
+        endpoint=endpoint,
+        pool_maxsize=args.background_threads + 1,
+        concurrency=concurrency,
+    )
+    stop = threading.Event()
+    crawled = [0]
+    crawled_lock = threading.Lock()
+
+    def crawl():
+        with request_priority("bulk") if lanes else nullcontext():
+            while not stop.is_set():
+                client.list_organization_builds("acme")
+                with crawled_lock:
+                    crawled[0] += 1
+
+    crawlers = [threading.Thread(target=crawl) for _ in range(args.background_threads)]
+    for thread in crawlers:
+        thread.start()
+    time.sleep(0.5)
+
+    latencies = []
+    started = time.perf_counter()
+    with request_priority("interactive") if lanes else nullcontext():
+        for _ in range(args.calls):
+            sent = time.perf_counter()
+            client.get_organization("acme")
+            latencies.append(time.perf_counter() - sent)
+            time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for thread in crawlers:
+        thread.join()
+    client.close()
+    return {
+        "p50": percentile(sorted(latencies), 50) * 1000,
+        "p99": percentile(sorted(latencies), 99) * 1000,
+        "crawl_rate": crawled[0] / elapsed,
+        "limit": int(concurrency.limit),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--background-threads", type=int, default=32)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=8, help="the client's concurrency limit")
+    parser.add_argument("--server-capacity", type=int, default=8)
+    parser.add_argument("--service-ms", type=float, default=10.0)
+    parser.add_argument(
+        "--interactive-service-ms", type=float, help="defaults to --service-ms"
+    )
+    parser.add_argument(
+        "--adaptive", action="store_true", help="let the concurrency limit adapt"
+    )
+    args = parser.parse_args()
+
+    SlowHandler.capacity = threading.BoundedSemaphore(args.server_capacity)
+    SlowHandler.service_time = args.service_ms / 1000
+    SlowHandler.interactive_service_time = (
+        args.service_ms if args.interactive_service_ms is None else args.interactive_service_ms
+    ) / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    for label, lanes in (("one priority", False), ("priority lanes", True)):
+        result = run(endpoint, args, lanes)
+        print(
+            f"{label}: interactive p50 {result['p50']:.1f} ms, p99 {result['p99']:.1f} ms; "
+            f"background crawl {result['crawl_rate']:.0f} requests/s"
+            + (f"; final limit {result['limit']}" if args.adaptive else "")
+        )
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Measures how fast render.py renders a large job log, and its peak memory.
+
+A synthetic log, with timestamp markers, colours, progress bars and groups
+on most lines, is generated block by block and rendered to HTML and to plain
+text without being kept in memory. The run fails if the process's peak
+memory grows past --max-rss-mb, which would mean the renderer is holding on
+to more than a line at a time.
+
+    python benchmarks/render_log.py --size-mb 200
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render import EmojiTable, render_log  # noqa: E402
+
+LINES = [
+    b"\x1b_bk;t=%d\x07--- :docker: Building image %d\n",
+    b"\x1b_bk;t=%d\x07\x1b[32mStep 3/12 :\x1b[0m RUN make -j8 target-%d\n",
+    b"\x1b_bk;t=%d\x07Downloading 10%%\rDownloading 50%%\rDownloading 100%% of %d\n",
+    b"\x1b_bk;t=%d\x07\x1b[1;31merror:\x1b[0m something <went> wrong & failed in test_%d\n",
+    b"\x1b_bk;t=%d\x07plain output line without any escape sequences at all, number %d\n",
+]
+
+
+def synthetic_log(size: int, block_size: int = 1 << 16):
+    block = []
+    block_length = 0
+    produced = 0
+    number = 0
+    while produced < size:
+        line = LINES[number % len(LINES)] % (1700000000000 + number, number)
+        block.append(line)
+        block_length += len(line)
+        number += 1
+        if block_length >= block_size:
+            produced += block_length
+            yield b"".join(block)
+            block, block_length = [], 0
+    if block:
+        yield b"".join(block)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--max-rss-mb", type=int, default=200)
+    args = parser.parse_args()
+    size = args.size_mb << 20
+    emojis = EmojiTable([{"name": "docker", "url": "https://example.com/docker.png"}])
+
+    for label, options in (("html", {"emojis": emojis}), ("text", {"html": False})):
+        started = time.perf_counter()
+        rendered = 0
+        for output in render_log(synthetic_log(size), **options):
+            rendered += len(output)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{label}: {args.size_mb} MB in {elapsed:.2f} s ({args.size_mb / elapsed:.1f} MB/s), "
+            f"{rendered / 1e6:.0f} M characters out"
+        )
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak memory: {peak_mb:.0f} MB (limit {args.max_rss_mb} MB)")
+    return 0 if peak_mb <= args.max_rss_mb else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
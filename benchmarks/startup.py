@@ -0,0 +1,69 @@
+"""Measures how long it takes to import main and construct a client.
+
+Short-lived hook scripts pay this cost on every run, so it is kept under a
+budget. The import is timed with python -X importtime in fresh interpreters,
+and the benchmark fails if the median is over budget or if requests was
+imported before the first request.
+
+    python benchmarks/startup.py --budget-ms 25
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import main
+main.BuildkiteClient("token")
+import sys
+print("requests" in sys.modules)
+"""
+
+
+def measure() -> tuple:
+    """Returns the cumulative import time of main in microseconds, and
+    whether requests was loaded by the import and construction."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = None
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "main":
+            cumulative = int(fields[1])
+    return cumulative, result.stdout.strip() == "True"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=25.0)
+    parser.add_argument("--runs", type=int, default=15)
+    args = parser.parse_args()
+
+    # The first run writes the bytecode cache, so it is not counted.
+    measure()
+    timings = []
+    for _ in range(args.runs):
+        cumulative, loaded_requests = measure()
+        if loaded_requests:
+            print("FAIL: requests was imported before the first request.")
+            return 1
+        timings.append(cumulative / 1000)
+
+    median = statistics.median(timings)
+    print(
+        f"import main: median {median:.1f} ms, min {min(timings):.1f} ms, "
+        f"max {max(timings):.1f} ms over {args.runs} runs (budget {args.budget_ms:.1f} ms)"
+    )
+    return 0 if median <= args.budget_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Hammers a local mock API from many threads through shared clients.
+
+Every request carries a unique query string, and the mock server echoes back
+the Authorization header and query it received. The run fails if any
+response belongs to another request or carries another organization's token,
+which would mean headers leaked between threads, or if any request errored.
+It also reports how many TCP connections were opened, which stays at about
+the pool size when connections are being shared correctly.
+
+    python benchmarks/thread_stress.py --threads 64 --requests 200
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import BuildkiteClient, BuildkiteMultiOrgClient  # noqa: E402
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    connections_lock = threading.Lock()
+
+    def do_GET(self):
+        with self.connections_lock:
+            self.connections.add(self.client_address)
+        url = urlparse(self.path)
+        body = json.dumps(
+            {
+                "authorization": self.headers.get("Authorization"),
+                "path": url.path,
+                "name": parse_qs(url.query).get("name", [None])[0],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def hammer(call, threads: int, requests_per_thread: int) -> list:
+    """Runs call(thread, index) from many threads and returns the failures."""
+    failures = []
+    failures_lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker(thread):
+        start.wait()
+        for index in range(requests_per_thread):
+            try:
+                problem = call(thread, index)
+            except Exception as error:  # noqa: BLE001 - every failure is reported
+                problem = repr(error)
+            if problem:
+                with failures_lock:
+                    failures.append(problem)
+
+    workers = [threading.Thread(target=worker, args=(thread,)) for thread in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    total = args.threads * args.requests
+    ok = True
+
+    # One client shared by every thread.
+    client = BuildkiteClient("token-a", endpoint=endpoint, pool_maxsize=args.threads)
+
+    def single(thread, index):
+        name = f"{thread}-{index}"
+        echo = client.list_agents("acme", params={"name": name}).json()
+        if echo["authorization"] != "Bearer token-a" or echo["name"] != name:
+            return f"single client: sent {name}, got {echo}"
+        return None
+
+    # Many organizations, with different tokens, sharing one connection pool.
+    org_tokens = {f"org-{index}": f"token-{index % 3}" for index in range(8)}
+    multi_client = BuildkiteMultiOrgClient(
+        org_tokens, pool_maxsize=args.threads, endpoint=endpoint
+    )
+
+    def multi(thread, index):
+        org_slug = f"org-{(thread + index) % len(org_tokens)}"
+        name = f"{thread}-{index}"
+        echo = multi_client.list_agents(org_slug, params={"name": name}).json()
+        expected = f"Bearer {org_tokens[org_slug]}"
+        if echo["authorization"] != expected or echo["name"] != name:
+            return f"multi-org client: sent {name} for {org_slug}, got {echo}"
+        if echo["path"] != f"/v2/organizations/{org_slug}/agents":
+            return f"multi-org client: sent {org_slug}, got {echo['path']}"
+        return None
+
+    for label, call in (("single client", single), ("multi-org client", multi)):
+        EchoHandler.connections.clear()
+        started = time.perf_counter()
+        failures = hammer(call, args.threads, args.requests)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{label}: {total} requests from {args.threads} threads in {elapsed:.2f} s "
+            f"({total / elapsed:.0f}/s), {len(EchoHandler.connections)} connections opened, "
+            f"{len(failures)} failures"
+        )
+        for failure in failures[:10]:
+            print(f"  {failure}")
+        ok = ok and not failures
+
+    client.close()
+    multi_client.close()
+    server.shutdown()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
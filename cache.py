@@ -0,0 +1,174 @@
+"""A persistent cache for builds that have finished, and their artifacts and annotations.
+
+Once a build reaches a terminal state its details, artifacts and annotations
+almost never change, so TerminalBuildCache keeps them on disk indefinitely
+and serves repeat reads without any network I/O:
+
+    cache = TerminalBuildCache("builds-cache.sqlite3")
+    buildkite_client = BuildkiteClient(buildkite_token, cache=cache)
+
+The client consults the cache for every GET and offers it every response:
+
+- A build is stored when its state is terminal, and from then on the build
+  is known to be finished.
+- Artifact and annotation lists, including every page of them, are only
+  stored for builds known to be finished.
+- Any write to a build (retrying or unblocking a job, deleting an artifact or
+  log, and so on) through the client invalidates everything stored for it.
+
+For changes made elsewhere, call invalidate() with the build.
+"""
+import json
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+TERMINAL_BUILD_STATES = {"passed", "failed", "canceled", "skipped", "not_run"}
+
+# The build a URL belongs to, and what part of the build it is.
+_BUILD_URL = re.compile(
+    r"/organizations/(?P<org>[^/]+)/pipelines/(?P<pipeline>[^/]+)/builds/(?P<number>\d+)"
+    r"(?P<resource>/[^?]*)?(?:\?.*)?$"
+)
+_CACHEABLE_RESOURCES = {None, "/artifacts", "/annotations"}
+
+# Only these response headers are kept; Link is needed for pagination.
+_KEPT_HEADERS = ("Content-Type", "Link")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    build TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_by_build ON responses (build);
+CREATE TABLE IF NOT EXISTS finished_builds (build TEXT PRIMARY KEY) WITHOUT ROWID;
+"""
+
+
+class TerminalBuildCache:
+    """An SQLite-backed cache of responses about finished builds."""
+
+    def __init__(self, path: str, memory_items: int = 128):
+        """
+        Args:
+            path: The SQLite database file, created if it does not exist.
+
+            memory_items: How many recently used responses to also keep in
+                memory. Everything else is read from disk.
+        """
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript(_SCHEMA)
+        self.__memory = OrderedDict()
+        self.__memory_items = memory_items
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.__db.close()
+
+    def get(self, url: str) -> requests.Response:
+        """Returns the cached response for a URL, or None."""
+        with self.__lock:
+            entry = self.__memory.get(url)
+            if entry is not None:
+                self.__memory.move_to_end(url)
+            else:
+                row = self.__db.execute(
+                    "SELECT status, headers, body FROM responses WHERE url = ?", (url,)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]), zlib.decompress(row[2]))
+                    self.__remember(url, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        status, headers, body = entry
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response._content_consumed = True
+        response.url = url
+        return response
+
+    def put(self, url: str, response: requests.Response):
+        """Stores a response if it is about a finished build."""
+        match = _BUILD_URL.search(url)
+        if match is None or response.status_code != 200:
+            return
+        resource = match["resource"] or None
+        if resource not in _CACHEABLE_RESOURCES:
+            return
+        build = _build_key(match)
+
+        with self.__lock:
+            if resource is None:
+                try:
+                    state = response.json().get("state")
+                except ValueError:
+                    return
+                if state not in TERMINAL_BUILD_STATES:
+                    return
+                self.__db.execute("INSERT OR IGNORE INTO finished_builds VALUES (?)", (build,))
+            elif not self.__is_finished(build):
+                return
+
+            headers = {
+                name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers
+            }
+            entry = (response.status_code, headers, response.content)
+            with self.__db:
+                self.__db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (url, build, entry[0], json.dumps(headers), zlib.compress(entry[2])),
+                )
+            self.__remember(url, entry)
+
+    def __is_finished(self, build: str) -> bool:
+        return (
+            self.__db.execute("SELECT 1 FROM finished_builds WHERE build = ?", (build,)).fetchone()
+            is not None
+        )
+
+    def __remember(self, url: str, entry: tuple):
+        self.__memory[url] = entry
+        self.__memory.move_to_end(url)
+        while len(self.__memory) > self.__memory_items:
+            self.__memory.popitem(last=False)
+
+    def invalidate(self, org_slug: str, pipeline_slug: str, build_number):
+        """Forgets everything stored about a build, for example after a rebuild
+        or when annotations were added outside of this client."""
+        build = f"{org_slug}/{pipeline_slug}/{int(build_number)}"
+        with self.__lock, self.__db:
+            urls = [
+                row[0]
+                for row in self.__db.execute("SELECT url FROM responses WHERE build = ?", (build,))
+            ]
+            self.__db.execute("DELETE FROM responses WHERE build = ?", (build,))
+            self.__db.execute("DELETE FROM finished_builds WHERE build = ?", (build,))
+            for url in urls:
+                self.__memory.pop(url, None)
+
+    def invalidate_url(self, url: str):
+        """Forgets everything stored about the build a URL belongs to, if any."""
+        match = _BUILD_URL.search(url)
+        if match is not None:
+            self.invalidate(match["org"], match["pipeline"], match["number"])
+
+
+def _build_key(match) -> str:
+    return f"{match['org']}/{match['pipeline']}/{int(match['number'])}"
@@ -0,0 +1,238 @@
+"""Records API traffic to a cassette file and replays it offline.
+
+A cassette is a gzip-compressed file with one JSON line per request/response
+pair. The Authorization header is never written, and any other secrets can be
+scrubbed from URLs, headers and bodies before they reach the disk.
+
+To record a workflow against the real API:
+
+    session = cassette_session("builds.cassette", mode="record")
+    buildkite_client = BuildkiteClient(buildkite_token, session=session)
+    ...
+    session.close()
+
+and to replay it later, with no network access and no real token:
+
+    session = cassette_session("builds.cassette", mode="replay", latency=0.05)
+    buildkite_client = BuildkiteClient("unused", session=session)
+"""
+import base64
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from main import BuildkiteError, BuildkiteSession
+
+SCRUBBED = "<SCRUBBED>"
+
+
+class CassetteAdapter(BaseAdapter):
+    """A transport adapter that records to, or replays from, a cassette.
+
+    In "record" mode requests are sent through a real HTTPAdapter and every
+    exchange is kept until close() or save() writes the cassette. In "replay"
+    mode responses are served from the cassette, matched on method, URL and
+    body. Identical requests are answered in recorded order, and the last
+    answer is repeated once they run out, so polling loops replay as well.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        scrub: list = None,
+        latency: float = 0.0,
+        bandwidth: int = None,
+        realtime: bool = False,
+    ):
+        """
+        Args:
+            path: The cassette file.
+
+            mode: Either "record" or "replay".
+
+            scrub (OPTIONAL): Strings, such as tokens or signed URL parameters,
+                to replace with <SCRUBBED> when recording. Pass the same list
+                when replaying so that requests still match.
+
+            latency: Seconds to wait before each replayed response.
+
+            bandwidth (OPTIONAL): Bytes per second to deliver replayed bodies
+                at. Unlimited by default.
+
+            realtime: Replay each response after its recorded duration instead
+                of the fixed latency.
+        """
+        super().__init__()
+        if mode not in ("record", "replay"):
+            raise ValueError('CassetteAdapter: mode must be "record" or "replay".')
+        self.path = path
+        self.mode = mode
+        self.__scrub = [secret for secret in (scrub or []) if secret]
+        self.__latency = latency
+        self.__bandwidth = bandwidth
+        self.__realtime = realtime
+        self.__lock = threading.Lock()
+        self.__entries = []
+        self.__responses = defaultdict(deque)
+
+        if mode == "record":
+            self.__transport = HTTPAdapter()
+        else:
+            self.__transport = None
+            for entry in load_cassette(path):
+                self.__responses[_match_key(entry["request"])].append(entry)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.mode == "record":
+            return self.__record(request, stream, timeout, verify, cert, proxies)
+        return self.__replay(request)
+
+    def __record(self, request, stream, timeout, verify, cert, proxies):
+        started = time.perf_counter()
+        response = self.__transport.send(
+            request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies
+        )
+        # Reading the content here keeps it on the response for the caller.
+        content = response.content
+        elapsed = time.perf_counter() - started
+
+        entry = {
+            "request": {
+                "method": request.method,
+                "url": self.__scrubbed(request.url),
+                "body": self.__scrubbed(_decode_body(request.body)),
+            },
+            "response": {
+                "status": response.status_code,
+                "reason": response.reason,
+                "headers": {
+                    name: self.__scrubbed(value)
+                    for name, value in response.headers.items()
+                    if name.lower() != "set-cookie"
+                },
+                **_encode_content(self.__scrubbed_bytes(content)),
+            },
+            "elapsed": round(elapsed, 6),
+        }
+        with self.__lock:
+            self.__entries.append(entry)
+        return response
+
+    def __replay(self, request):
+        key = _match_key(
+            {
+                "method": request.method,
+                "url": self.__scrubbed(request.url),
+                "body": self.__scrubbed(_decode_body(request.body)),
+            }
+        )
+        with self.__lock:
+            queue = self.__responses.get(key)
+            if not queue:
+                raise BuildkiteError(
+                    f"CassetteAdapter: no recorded response for {request.method} {request.url}."
+                )
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+
+        recorded = entry["response"]
+        content = _decode_content(recorded)
+        delay = entry["elapsed"] if self.__realtime else self.__latency
+        if self.__bandwidth:
+            delay += len(content) / self.__bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded.get("reason")
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def __scrubbed(self, text):
+        if text is None:
+            return None
+        for secret in self.__scrub:
+            text = text.replace(secret, SCRUBBED)
+        return text
+
+    def __scrubbed_bytes(self, content: bytes) -> bytes:
+        for secret in self.__scrub:
+            content = content.replace(secret.encode(), SCRUBBED.encode())
+        return content
+
+    def save(self):
+        """Writes everything recorded so far to the cassette."""
+        with self.__lock:
+            entries = list(self.__entries)
+        with gzip.open(self.path, "wt", encoding="utf-8") as cassette:
+            for entry in entries:
+                cassette.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self):
+        if self.mode == "record":
+            self.save()
+            self.__transport.close()
+
+
+def load_cassette(path: str) -> list:
+    """Reads every recorded exchange from a cassette file."""
+    with gzip.open(path, "rt", encoding="utf-8") as cassette:
+        return [json.loads(line) for line in cassette if line.strip()]
+
+
+def cassette_session(path: str, mode: str = "replay", **kwargs) -> BuildkiteSession:
+    """Creates a session that records to, or replays from, a cassette.
+
+    Args:
+        path: The cassette file.
+
+        mode: Either "record" or "replay".
+
+        **kwargs: Passed on to CassetteAdapter.
+
+    Returns:
+        BuildkiteSession: A session to pass to BuildkiteClient. Close it to
+            write a recorded cassette.
+    """
+    session = BuildkiteSession()
+    adapter = CassetteAdapter(path, mode=mode, **kwargs)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _match_key(request: dict) -> tuple:
+    return request["method"], request["url"], request.get("body")
+
+
+def _decode_body(body):
+    if isinstance(body, bytes):
+        return body.decode("utf-8", errors="replace")
+    return body
+
+
+def _encode_content(content: bytes) -> dict:
+    try:
+        return {"body": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body_base64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_content(recorded: dict) -> bytes:
+    if "body_base64" in recorded:
+        return base64.b64decode(recorded["body_base64"])
+    return recorded.get("body", "").encode("utf-8")
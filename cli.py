@@ -0,0 +1,288 @@
+"""A command-line interface for common operations on top of BuildkiteClient.
+
+Results are written as NDJSON, one JSON object per line, as soon as each one
+arrives, so the output can be piped straight into jq or another process.
+Fan-out commands take --parallel to run several API calls at once.
+
+    python main.py builds acme-inc --state running | jq .web_url
+    python main.py agents acme-inc > agents.ndjson
+    echo "41 42 43" | python main.py --parallel 8 cancel acme-inc my-pipeline -
+
+The API access token is read from the BUILDKITE_TOKEN environment variable,
+or given with --token.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+
+from main import BuildkiteClient, BuildkiteError, _json
+
+FINISHED_JOB_STATES = {
+    "passed", "failed", "canceled", "timed_out", "skipped", "broken", "expired", "finished",
+}
+
+_output_lock = threading.Lock()
+
+
+def emit(item: dict):
+    """Writes one NDJSON line and flushes it straight away."""
+    with _output_lock:
+        sys.stdout.write(json.dumps(item, separators=(",", ":")) + "\n")
+        sys.stdout.flush()
+
+
+def fan_out(func, items: list, parallel: int, describe=None):
+    """Calls func for every item on up to parallel threads, emitting results
+    in the order they complete.
+
+    An API or connection error only fails its own item, which is emitted as
+    describe(item) with the "error" added, so the other items carry on.
+
+    Args:
+        func: Returns the result to emit for an item.
+
+        items: The items to call func for.
+
+        parallel: How many items to work on at once.
+
+        describe (OPTIONAL): Returns a dict identifying an item in its error
+            result. By default the item is given as "item".
+    """
+
+    def call(item):
+        try:
+            return func(item)
+        except (BuildkiteError, requests.RequestException) as error:
+            result = describe(item) if describe is not None else {"item": item}
+            return {**result, "error": str(error)}
+
+    if parallel <= 1:
+        for item in items:
+            emit(call(item))
+        return
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        for future in as_completed([executor.submit(call, item) for item in items]):
+            emit(future.result())
+
+
+def read_build_numbers(values: list) -> list:
+    """Returns build numbers from the arguments, reading them from stdin for "-"."""
+    numbers = []
+    for value in values:
+        if value == "-":
+            numbers.extend(sys.stdin.read().split())
+        else:
+            numbers.append(value)
+    return numbers
+
+
+def safe_destination(root: str, path: str) -> str:
+    """Returns where to write a file at path under root, or None if it would
+    end up outside of root, for example through an absolute path or "..".
+
+    Args:
+        root: The directory files must stay in.
+
+        path: The relative path reported by the API, which is not trusted.
+    """
+    root = os.path.realpath(root)
+    destination = os.path.realpath(os.path.join(root, path))
+    if destination == root or os.path.commonpath([root, destination]) != root:
+        return None
+    return destination
+
+
+def list_builds(client: BuildkiteClient, args) -> int:
+    params = {"per_page": 100}
+    if args.state:
+        params["state"] = args.state
+    if args.branch:
+        params["branch"] = args.branch
+    if args.pipeline:
+        first_page = client.list_pipeline_builds(args.org, args.pipeline, params=params)
+    else:
+        first_page = client.list_organization_builds(args.org, params=params)
+    for build in client.iterate(first_page, max_pages=args.max_pages):
+        emit(build)
+    return 0
+
+
+def tail_log(client: BuildkiteClient, args) -> int:
+    printed = 0
+    while True:
+        log = _json(client.get_job_log(args.org, args.pipeline, args.build, args.job))
+        content = log.get("content") or ""
+        sys.stdout.write(content[printed:])
+        sys.stdout.flush()
+        printed = len(content)
+        if not args.follow:
+            return 0
+        build = _json(client.get_build(args.org, args.pipeline, args.build))
+        job = next((job for job in build["jobs"] if job.get("id") == args.job), None)
+        if job is None or job.get("state") in FINISHED_JOB_STATES:
+            return 0
+        time.sleep(args.interval)
+
+
+def download_artifacts(client: BuildkiteClient, args) -> int:
+    first_page = client.list_build_artifacts(args.org, args.pipeline, args.build)
+    artifacts = list(client.iterate(first_page))
+    cache = None
+    if args.cache:
+        from artifact_cache import ArtifactCache
+
+        cache = ArtifactCache(args.cache)
+
+    def download(artifact):
+        destination = safe_destination(args.dest, artifact["path"])
+        if destination is None:
+            return {"id": artifact["id"], "path": artifact["path"], "error": "unsafe path"}
+        if cache is not None:
+            cache.export(client, args.org, args.pipeline, args.build, artifact, destination)
+            return {"id": artifact["id"], "path": artifact["path"], "file": destination}
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        response = client.download_artifact(
+            args.org, args.pipeline, args.build, artifact["job_id"], artifact["id"], stream=True
+        )
+        if not response.ok:
+            return {"id": artifact["id"], "path": artifact["path"], "error": response.status_code}
+        with response, open(destination, "wb") as artifact_file:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                artifact_file.write(chunk)
+        return {"id": artifact["id"], "path": artifact["path"], "file": destination}
+
+    fan_out(
+        download,
+        artifacts,
+        args.parallel,
+        describe=lambda artifact: {"id": artifact["id"], "path": artifact["path"]},
+    )
+    return 0
+
+
+def cancel_builds(client: BuildkiteClient, args) -> int:
+    def cancel(build_number):
+        response = client.cancel_build(args.org, args.pipeline, build_number)
+        return {"build": build_number, "status": response.status_code}
+
+    fan_out(
+        cancel,
+        read_build_numbers(args.builds),
+        args.parallel,
+        describe=lambda build_number: {"build": build_number},
+    )
+    return 0
+
+
+def retry_builds(client: BuildkiteClient, args) -> int:
+    def retry(build_number):
+        build = _json(client.get_build(args.org, args.pipeline, build_number))
+        retried = []
+        failed = {}
+        for job in build["jobs"]:
+            if job.get("state") not in ("failed", "timed_out") or job.get("retried"):
+                continue
+            response = client.retry_job(args.org, args.pipeline, build_number, job["id"])
+            if response.ok:
+                retried.append(job["id"])
+            else:
+                failed[job["id"]] = response.status_code
+        result = {"build": build_number, "retried_jobs": retried}
+        if failed:
+            result["failed_jobs"] = failed
+        return result
+
+    fan_out(
+        retry,
+        read_build_numbers(args.builds),
+        args.parallel,
+        describe=lambda build_number: {"build": build_number},
+    )
+    return 0
+
+
+def snapshot_agents(client: BuildkiteClient, args) -> int:
+    for agent in client.iterate(client.list_agents(args.org, params={"per_page": 100})):
+        emit(agent)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="buildkite", description="Streams Buildkite API results as NDJSON."
+    )
+    parser.add_argument("--token", default=os.environ.get("BUILDKITE_TOKEN"))
+    parser.add_argument(
+        "--parallel", type=int, default=4, help="API calls to run at once for fan-out commands"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    builds = commands.add_parser("builds", help="list builds")
+    builds.add_argument("org")
+    builds.add_argument("--pipeline")
+    builds.add_argument("--state")
+    builds.add_argument("--branch")
+    builds.add_argument("--max-pages", type=int)
+    builds.set_defaults(func=list_builds)
+
+    log = commands.add_parser("log", help="print, or follow, a job's log")
+    log.add_argument("org")
+    log.add_argument("pipeline")
+    log.add_argument("build")
+    log.add_argument("job")
+    log.add_argument("--follow", "-f", action="store_true")
+    log.add_argument("--interval", type=float, default=2.0)
+    log.set_defaults(func=tail_log)
+
+    artifacts = commands.add_parser("artifacts", help="download a build's artifacts")
+    artifacts.add_argument("org")
+    artifacts.add_argument("pipeline")
+    artifacts.add_argument("build")
+    artifacts.add_argument("--dest", default=".")
+    artifacts.add_argument(
+        "--cache", help="a host-wide artifact cache directory, shared with other processes"
+    )
+    artifacts.set_defaults(func=download_artifacts)
+
+    for name, func, help_text in (
+        ("cancel", cancel_builds, "cancel builds"),
+        ("retry", retry_builds, "retry the failed jobs of builds"),
+    ):
+        bulk = commands.add_parser(name, help=help_text)
+        bulk.add_argument("org")
+        bulk.add_argument("pipeline")
+        bulk.add_argument("builds", nargs="+", help='build numbers, or "-" to read them from stdin')
+        bulk.set_defaults(func=func)
+
+    agents = commands.add_parser("agents", help="snapshot an organization's agents")
+    agents.add_argument("org")
+    agents.set_defaults(func=snapshot_agents)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    if not args.token:
+        print("buildkite: set BUILDKITE_TOKEN or pass --token.", file=sys.stderr)
+        return 2
+    client = BuildkiteClient(args.token)
+    try:
+        return args.func(client, args)
+    except (BuildkiteError, requests.RequestException) as error:
+        print(f"buildkite: {error}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # The reader went away, for example `| head`.
+        sys.stderr.close()
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""Tools for crawling large numbers of pages from list endpoints.
+
+map_pages() keeps the network and the CPU busy at the same time when
+crawling: pages are fetched by I/O threads, while decoding the JSON and
+projecting or aggregating the items runs in a pool of worker processes, so
+it is not held back by the GIL. The raw body of each page is handed to the
+workers through shared memory rather than being pickled, and results come
+back in page order.
+
+    def project(builds):
+        return [(build["number"], build["state"], build["created_at"]) for build in builds]
+
+    first_page = buildkite_client.list_organization_builds(org_slug, params={"per_page": 100})
+    for rows in map_pages(buildkite_client, first_page, project):
+        ...
+
+The transform must be a module-level function, so that it can be sent to the
+worker processes.
+
+crawl_builds() walks long stretches of build history without following one
+long chain of page links. The time range is split into created_from and
+created_to shards that are crawled concurrently; a shard that turns out to
+have more than a few pages of builds stops early and hands the rest of its
+range back as smaller shards. Builds are yielded newest first, as soon as
+every newer shard is done:
+
+    for build in crawl_builds(buildkite_client, org_slug, "2023-01-01", "2024-01-01",
+                              checkpoint_dir="crawl-2023"):
+        ...
+
+With checkpoint_dir, every finished shard is saved, so running the same crawl
+again after an interruption only fetches the ranges that were not finished.
+"""
+import gzip
+import json
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from multiprocessing import shared_memory
+from typing import Callable, Iterator
+
+import requests
+
+from analytics import parse_timestamp
+from main import BuildkiteClient, BuildkiteError, _carry_priority, _json
+
+_DONE = object()
+
+
+def _decode_page(name: str, size: int, transform: Callable):
+    """Runs in a worker process: decodes a page from shared memory."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        items = json.loads(bytes(block.buf[:size]))
+    finally:
+        block.close()
+    return transform(items)
+
+
+def map_pages(
+    client: BuildkiteClient,
+    first_pages,
+    transform: Callable,
+    processes: int = None,
+    io_threads: int = 4,
+    max_in_flight: int = 8,
+) -> Iterator:
+    """Decodes and transforms every page of one or more list calls in parallel.
+
+    Args:
+        client: The client to fetch the following pages with.
+
+        first_pages: The response to the first page of a list call, or a list
+            of them, for example one per time range. Each one is followed
+            through its pages by its own I/O thread.
+
+        transform: A module-level function called, in a worker process, with
+            the decoded items of each page. Its return value is yielded.
+
+        processes (OPTIONAL): The number of worker processes. Defaults to the
+            number of CPUs.
+
+        io_threads: The number of list calls followed at the same time.
+
+        max_in_flight: The number of pages per list call that may be fetched
+            ahead of the results being consumed.
+
+    Returns:
+        Iterator: The result of transform for every page, in order: all pages
+            of the first list call, then all pages of the second, and so on.
+
+    Raises:
+        BuildkiteError: If any page could not be fetched.
+    """
+    if isinstance(first_pages, requests.Response):
+        first_pages = [first_pages]
+    queues = [queue.Queue(maxsize=max_in_flight) for _ in first_pages]
+    stop = threading.Event()
+
+    def fetch(first_page, pages, pool):
+        try:
+            for page in client.paginate(first_page):
+                if stop.is_set():
+                    break
+                if not page.ok:
+                    _json(page)
+                content = page.content
+                block = shared_memory.SharedMemory(create=True, size=max(len(content), 1))
+                block.buf[: len(content)] = content
+                future = pool.submit(_decode_page, block.name, len(content), transform)
+                pages.put((future, block))
+        except Exception as error:  # noqa: BLE001 - re-raised by the consumer
+            pages.put(error)
+        pages.put(_DONE)
+
+    def release(item):
+        if isinstance(item, tuple):
+            future, block = item
+            future.cancel()
+            block.close()
+            block.unlink()
+
+    # List calls are followed in order, so the one being consumed always has
+    # a running fetcher, however many are waiting for an I/O thread.
+    with ProcessPoolExecutor(max_workers=processes) as pool, ThreadPoolExecutor(
+        max_workers=io_threads, thread_name_prefix="buildkite-crawl"
+    ) as fetchers:
+        fetches = [
+            fetchers.submit(_carry_priority(fetch), first_page, pages, pool)
+            for first_page, pages in zip(first_pages, queues)
+        ]
+        finished = set()
+        try:
+            for index, pages in enumerate(queues):
+                while True:
+                    item = pages.get()
+                    if item is _DONE:
+                        finished.add(index)
+                        break
+                    if isinstance(item, Exception):
+                        finished.add(index)
+                        raise item
+                    future, block = item
+                    try:
+                        result = future.result()
+                    finally:
+                        block.close()
+                        block.unlink()
+                    yield result
+        finally:
+            # Stop early, and release the shared memory of unconsumed pages.
+            stop.set()
+            for index, fetch_future in enumerate(fetches):
+                if fetch_future.cancel():
+                    finished.add(index)
+            while len(finished) < len(queues):
+                for index, pages in enumerate(queues):
+                    if index in finished:
+                        continue
+                    try:
+                        item = pages.get(timeout=0.05)
+                    except queue.Empty:
+                        continue
+                    release(item)
+                    if item is _DONE or isinstance(item, Exception):
+                        finished.add(index)
+
+
+def _epoch_seconds(value) -> int:
+    """Converts a datetime, an ISO 8601 string or a POSIX timestamp to whole seconds."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return _epoch_seconds(parsed)
+    return int(value)
+
+
+def _iso(seconds: int) -> str:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _split(start: int, end: int, parts: int) -> list:
+    """Splits [start, end) into up to parts ranges of whole seconds, newest first."""
+    parts = max(1, min(parts, end - start))
+    bounds = [start + (end - start) * index // parts for index in range(parts + 1)]
+    return [(low, high) for low, high in zip(bounds, bounds[1:])][::-1]
+
+
+class _Checkpoint:
+    """The finished shards of a crawl, one compressed file per shard."""
+
+    def __init__(self, directory: str, query: dict):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        query_path = os.path.join(directory, "crawl.json")
+        if os.path.exists(query_path):
+            with open(query_path) as query_file:
+                if json.load(query_file) != query:
+                    raise BuildkiteError(
+                        f"crawl_builds: {directory} holds the checkpoint of a different crawl."
+                    )
+        else:
+            with open(query_path, "w") as query_file:
+                json.dump(query, query_file)
+
+    def __path(self, start: int, end: int) -> str:
+        return os.path.join(self.directory, f"{start}-{end}.json.gz")
+
+    def finished(self) -> dict:
+        """Returns the finished shards, as a mapping of end to start."""
+        shards = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".json.gz"):
+                start, end = name[: -len(".json.gz")].split("-")
+                shards[int(end)] = int(start)
+        return shards
+
+    def save(self, start: int, end: int, builds: list):
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, "wb") as temporary_file:
+            temporary_file.write(gzip.compress(json.dumps(builds).encode("utf-8")))
+        os.replace(temporary, self.__path(start, end))
+
+    def load(self, start: int, end: int) -> list:
+        with open(self.__path(start, end), "rb") as shard_file:
+            return json.loads(gzip.decompress(shard_file.read()))
+
+
+def crawl_builds(
+    client: BuildkiteClient,
+    org_slug: str,
+    created_from,
+    created_to,
+    pipeline_slug: str = None,
+    params: dict = None,
+    shards: int = None,
+    max_workers: int = 8,
+    max_pages_per_shard: int = 10,
+    checkpoint_dir: str = None,
+) -> Iterator[dict]:
+    """Crawls the builds created in a time range, in concurrent time shards.
+
+    Args:
+        client: The client to list builds with.
+
+        org_slug: The organization slug is a simplified version of the
+            organisation name. You can find this within the full details of
+            an organization using list_organizations().
+
+        created_from: The start of the range, inclusive: a datetime, an ISO
+            8601 string or a POSIX timestamp. Naive datetimes are UTC.
+
+        created_to: The end of the range, exclusive.
+
+        pipeline_slug (OPTIONAL): Only crawl the builds of this pipeline.
+
+        params (OPTIONAL): Other filters, as for list_organization_builds().
+            per_page defaults to 100.
+
+        shards (OPTIONAL): The number of shards to start with. Defaults to
+            max_workers.
+
+        max_workers: The number of shards crawled at the same time.
+
+        max_pages_per_shard: After this many pages, a shard stops and the
+            part of its range it has not reached is split in two.
+
+        checkpoint_dir (OPTIONAL): A directory to save finished shards in.
+            Running the same crawl with it again only fetches the ranges that
+            were not finished.
+
+    Returns:
+        Iterator: Every build in the range once, newest first.
+
+    Raises:
+        BuildkiteError: If a page could not be fetched, or checkpoint_dir
+            belongs to a different crawl.
+    """
+    start = _epoch_seconds(created_from)
+    end = _epoch_seconds(created_to)
+    params = {"per_page": 100, **(params or {})}
+    checkpoint = None
+    finished = {}
+    if checkpoint_dir is not None:
+        query = {
+            "org": org_slug,
+            "pipeline": pipeline_slug,
+            "params": params,
+            "created_from": start,
+            "created_to": end,
+        }
+        checkpoint = _Checkpoint(checkpoint_dir, query)
+        finished = {
+            shard_end: (shard_start, None)
+            for shard_end, shard_start in checkpoint.finished().items()
+        }
+
+    def list_builds(shard_params):
+        if pipeline_slug is None:
+            return client.list_organization_builds(org_slug, params=shard_params)
+        return client.list_pipeline_builds(org_slug, pipeline_slug, params=shard_params)
+
+    def crawl_shard(shard_start, shard_end):
+        """Returns the part of the shard that was crawled, and its builds."""
+        first_page = list_builds(
+            {**params, "created_from": _iso(shard_start), "created_to": _iso(shard_end)}
+        )
+        builds = {}
+        oldest = None
+        for number, page in enumerate(client.paginate(first_page), start=1):
+            for build in _json(page):
+                # Builds created during the crawl shift items across pages.
+                builds[build["id"]] = build
+                created_at = parse_timestamp(build["created_at"])
+                oldest = created_at if oldest is None else min(oldest, created_at)
+            if number >= max_pages_per_shard and "next" in page.links:
+                # Every build created from the second after the oldest one
+                # seen has been seen; the rest of the range is split up.
+                done_from = int(oldest) + 1
+                if shard_start < done_from < shard_end:
+                    kept = [
+                        build
+                        for build in builds.values()
+                        if parse_timestamp(build["created_at"]) >= done_from
+                    ]
+                    return done_from, shard_end, kept
+        return shard_start, shard_end, list(builds.values())
+
+    # Shards are only ever split at their start, so every range still to be
+    # crawled ends where an existing or future finished shard starts.
+    pending = []
+    cursor = end
+    for shard_end in sorted(finished, reverse=True) + [start]:
+        if shard_end < cursor:
+            pending.extend(_split(shard_end, cursor, shards or max_workers))
+        if shard_end in finished:
+            cursor = finished[shard_end][0]
+
+    crawl_shard = _carry_priority(crawl_shard)
+    cursor = end
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="buildkite-crawl") as executor:
+        running = {executor.submit(crawl_shard, *shard): shard for shard in pending}
+        try:
+            while True:
+                # Yield finished shards in order, as soon as every newer one is done.
+                while cursor in finished:
+                    shard_start, builds = finished.pop(cursor)
+                    if builds is None:
+                        builds = checkpoint.load(shard_start, cursor)
+                    builds.sort(key=lambda build: parse_timestamp(build["created_at"]), reverse=True)
+                    yield from builds
+                    cursor = shard_start
+                if not running:
+                    return
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    requested_start, _ = running.pop(future)
+                    shard_start, shard_end, builds = future.result()
+                    if checkpoint is not None:
+                        checkpoint.save(shard_start, shard_end, builds)
+                    finished[shard_end] = (shard_start, builds)
+                    if shard_start > requested_start:
+                        for shard in _split(requested_start, shard_start, 2):
+                            running[executor.submit(crawl_shard, *shard)] = shard
+        finally:
+            for future in running:
+                future.cancel()
@@ -0,0 +1,224 @@
+"""Finds flaky steps from the retry history of finished builds.
+
+A step is flaky in a build when one of its jobs failed and a retry of that
+job then passed. FlakyIndex keeps one row per step per build in a small SQLite file,
+so each run only has to ingest the builds that finished since the last one,
+and queries over any number of days are answered without calling the API.
+
+    index = FlakyIndex("flaky.sqlite3")
+    index.ingest(buildkite_client, org_slug, "my-pipeline")
+    for step in index.top_flaky(org_slug, "my-pipeline", days=14):
+        print(step["step_key"], step["flake_rate"])
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from analytics import FAILED_STATES, iter_builds, parse_timestamp
+from main import BuildkiteClient
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS step_runs (
+    org TEXT NOT NULL,
+    pipeline TEXT NOT NULL,
+    build_number INTEGER NOT NULL,
+    step_key TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    failed_attempts INTEGER NOT NULL,
+    flaky INTEGER NOT NULL,
+    PRIMARY KEY (org, pipeline, build_number, step_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS step_runs_by_time ON step_runs (org, pipeline, created_at);
+CREATE TABLE IF NOT EXISTS cursors (
+    org TEXT NOT NULL,
+    pipeline TEXT NOT NULL,
+    finished_from TEXT NOT NULL,
+    PRIMARY KEY (org, pipeline)
+) WITHOUT ROWID;
+"""
+
+
+def step_outcomes(build: dict) -> dict:
+    """Summarises the attempts at each step of a build.
+
+    A step is flaky when one of its jobs failed, was retried, and the retry,
+    or a retry of that, passed. Retries are followed through
+    "retried_in_job_id", falling back to the next attempt at the same shard
+    ("parallel_group_index") of the step, so a parallel or matrix step where
+    one shard failed and another passed is not flaky.
+
+    Args:
+        build: A build fetched with {'include_retried_jobs': 'true'}.
+
+    Returns:
+        dict: For each step key (or step name, for steps without a key), a
+            tuple of (attempts, failed attempts, whether the step was flaky).
+    """
+    attempts = {}
+    shards = {}
+    for job in build.get("jobs", []):
+        if job.get("type") != "script":
+            continue
+        step_key = job.get("step_key") or job.get("name") or ""
+        attempts.setdefault(step_key, []).append(job)
+        shards.setdefault((step_key, job.get("parallel_group_index")), []).append(job)
+
+    by_id = {job.get("id"): job for jobs in attempts.values() for job in jobs}
+    next_attempt = {}
+    for jobs in shards.values():
+        for earlier, later in zip(jobs, jobs[1:]):
+            next_attempt[id(earlier)] = later
+
+    def final_attempt(job):
+        seen = set()
+        while job.get("retried") and id(job) not in seen:
+            seen.add(id(job))
+            retry = by_id.get(job.get("retried_in_job_id")) or next_attempt.get(id(job))
+            if retry is None:
+                break
+            job = retry
+        return job
+
+    outcomes = {}
+    for step_key, jobs in attempts.items():
+        failed = [job for job in jobs if job.get("state") in FAILED_STATES]
+        flaky = any(
+            job.get("retried") and final_attempt(job).get("state") == "passed" for job in failed
+        )
+        outcomes[step_key] = (len(jobs), len(failed), flaky)
+    return outcomes
+
+
+class FlakyIndex:
+    """A persistent, incrementally updated index of per-step retry outcomes."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The SQLite database file, created if it does not exist.
+        """
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript(_SCHEMA)
+
+    def close(self):
+        self.__db.close()
+
+    def add_builds(self, org_slug: str, builds) -> int:
+        """Adds or replaces the step outcomes of finished builds.
+
+        Args:
+            org_slug: The organization the builds belong to.
+
+            builds: The output of the list_*_builds functions, fetched with
+                {'include_retried_jobs': 'true'}.
+
+        Returns:
+            int: The number of builds added.
+        """
+        rows = []
+        count = 0
+        for build in iter_builds(builds):
+            count += 1
+            pipeline_slug = build.get("pipeline", {}).get("slug", "")
+            created_at = parse_timestamp(build.get("created_at"))
+            for step_key, (attempts, failed, flaky) in step_outcomes(build).items():
+                rows.append(
+                    (org_slug, pipeline_slug, build["number"], step_key, created_at,
+                     attempts, failed, int(flaky))
+                )
+        with self.__lock, self.__db:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO step_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        return count
+
+    def ingest(
+        self, client: BuildkiteClient, org_slug: str, pipeline_slug: str = None
+    ) -> int:
+        """Adds every build that finished since the last ingest.
+
+        Builds are listed with the finished_from filter, so a build that is
+        retried after it first finished is ingested again and replaced.
+
+        Args:
+            client: The client to list builds with.
+
+            org_slug: The organization slug is a simplified version of the
+                organisation name. You can find this within the full details of
+                an organization using list_organizations().
+
+            pipeline_slug (OPTIONAL): Only ingest builds of this pipeline.
+                Defaults to every pipeline in the organization.
+
+        Returns:
+            int: The number of builds ingested.
+        """
+        cursor_key = (org_slug, pipeline_slug or "")
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT finished_from FROM cursors WHERE org = ? AND pipeline = ?",
+                cursor_key,
+            ).fetchone()
+        started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        params = {"include_retried_jobs": "true", "state": "finished", "per_page": 100}
+        if row is not None:
+            params["finished_from"] = row[0]
+        if pipeline_slug is None:
+            first_page = client.list_organization_builds(org_slug, params=params)
+        else:
+            first_page = client.list_pipeline_builds(org_slug, pipeline_slug, params=params)
+        count = self.add_builds(org_slug, client.iterate(first_page))
+
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)", (*cursor_key, started)
+            )
+        return count
+
+    def top_flaky(
+        self, org_slug: str, pipeline_slug: str = None, days: float = 30, limit: int = 10
+    ) -> list:
+        """Returns the flakiest steps of recent builds.
+
+        Args:
+            org_slug: The organization to report on.
+
+            pipeline_slug (OPTIONAL): Only report on this pipeline.
+
+            days: How far back, by build creation time, to look.
+
+            limit: The number of steps to return.
+
+        Returns:
+            list: Dicts with the "pipeline", "step_key", number of "runs" and
+                "flaky_runs", and the "flake_rate", flakiest first.
+        """
+        query = (
+            "SELECT pipeline, step_key, COUNT(*), SUM(flaky) FROM step_runs "
+            "WHERE org = ? AND created_at >= ?"
+        )
+        args = [org_slug, time.time() - days * 86400]
+        if pipeline_slug is not None:
+            query += " AND pipeline = ?"
+            args.append(pipeline_slug)
+        query += (
+            " GROUP BY pipeline, step_key HAVING SUM(flaky) > 0"
+            " ORDER BY SUM(flaky) * 1.0 / COUNT(*) DESC, SUM(flaky) DESC LIMIT ?"
+        )
+        args.append(limit)
+        with self.__lock:
+            rows = self.__db.execute(query, args).fetchall()
+        return [
+            {
+                "pipeline": pipeline,
+                "step_key": step_key,
+                "runs": runs,
+                "flaky_runs": flaky_runs,
+                "flake_rate": flaky_runs / runs,
+            }
+            for pipeline, step_key, runs, flaky_runs in rows
+        ]
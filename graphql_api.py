@@ -0,0 +1,284 @@
+"""Fetches nested data through the GraphQL API, shaped like REST results.
+
+Building a dashboard of pipelines with their latest builds through the REST
+API takes one list_pipelines() call plus one list_pipeline_builds() call per
+pipeline. list_pipelines_with_builds() fetches the same data in one GraphQL
+request per page of pipelines:
+
+    for pipeline in list_pipelines_with_builds(buildkite_client, org_slug, builds_per_pipeline=3):
+        for build in pipeline["builds"]:
+            print(pipeline["slug"], build["number"], build["state"], len(build["jobs"]))
+
+Pipelines, builds and jobs come back with the same keys as the REST API
+returns (IDs are UUIDs, states are lowercase), limited to the fields listed
+in the queries below. Jobs that do not fit in the first page of a build are
+fetched afterwards, for many builds at once in one batched query.
+
+The GraphQL endpoint is set with BuildkiteClient(graphql_endpoint=...), so
+these functions can run against a local stand-in server, such as the one in
+benchmarks/graphql_stand_in.py.
+"""
+from typing import Iterator
+
+from main import BuildkiteClient
+
+JOBS_PAGE_SIZE = 100
+
+
+# How many builds' remaining jobs are fetched per batched query.
+JOBS_BATCH_SIZE = 20
+
+_JOB_FIELDS = """
+    __typename
+    ... on JobTypeCommand {
+        id uuid label command state passed exitStatus
+        scheduledAt runnableAt startedAt finishedAt
+        step { key }
+        agent { uuid name }
+    }
+    ... on JobTypeWait { id uuid state }
+    ... on JobTypeBlock { id uuid label state }
+    ... on JobTypeTrigger { id uuid label state }
+"""
+
+_BUILD_FIELDS = f"""
+    id uuid number state branch commit message url
+    createdAt scheduledAt startedAt finishedAt
+    jobs(first: {JOBS_PAGE_SIZE}) {{
+        pageInfo {{ hasNextPage endCursor }}
+        edges {{ node {{ {_JOB_FIELDS} }} }}
+    }}
+"""
+
+_PIPELINES_QUERY = f"""
+query PipelinesWithBuilds(
+    $org: ID!, $first: Int!, $after: String, $builds: Int!, $branch: [String!]
+) {{
+    organization(slug: $org) {{
+        pipelines(first: $first, after: $after) {{
+            pageInfo {{ hasNextPage endCursor }}
+            edges {{ node {{
+                id uuid slug name description defaultBranch url
+                repository {{ url }}
+                builds(first: $builds, branch: $branch) {{
+                    edges {{ node {{ {_BUILD_FIELDS} }} }}
+                }}
+            }} }}
+        }}
+    }}
+}}
+"""
+
+# REST job types, by GraphQL type name.
+_JOB_TYPES = {
+    "JobTypeCommand": "script",
+    "JobTypeWait": "waiter",
+    "JobTypeBlock": "manual",
+    "JobTypeTrigger": "trigger",
+}
+
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _nodes(connection: dict) -> list:
+    return [edge["node"] for edge in (connection or {}).get("edges") or []]
+
+
+def _job_state(node: dict):
+    """Returns the REST state of a job. GraphQL reports finished command jobs
+    as FINISHED, with whether they passed in a separate field."""
+    state = node.get("state")
+    if state == "FINISHED" and node.get("passed") is not None:
+        return "passed" if node["passed"] else "failed"
+    return _lower(state)
+
+
+def rest_job(node: dict) -> dict:
+    """Maps a GraphQL job onto the shape of a job in a REST build."""
+    exit_status = node.get("exitStatus")
+    if isinstance(exit_status, str) and exit_status.lstrip("-").isdigit():
+        exit_status = int(exit_status)
+    agent = node.get("agent")
+    return {
+        "id": node.get("uuid"),
+        "graphql_id": node.get("id"),
+        "type": _JOB_TYPES.get(node.get("__typename"), node.get("__typename")),
+        "name": node.get("label"),
+        "step_key": (node.get("step") or {}).get("key"),
+        "command": node.get("command"),
+        "state": _job_state(node),
+        "exit_status": exit_status,
+        "scheduled_at": node.get("scheduledAt"),
+        "runnable_at": node.get("runnableAt"),
+        "started_at": node.get("startedAt"),
+        "finished_at": node.get("finishedAt"),
+        "agent": {"id": agent.get("uuid"), "name": agent.get("name")} if agent else None,
+    }
+
+
+def rest_build(node: dict, pipeline: dict = None) -> dict:
+    """Maps a GraphQL build onto the shape returned by get_build().
+
+    Args:
+        node: The GraphQL build.
+
+        pipeline (OPTIONAL): The REST-shaped pipeline the build belongs to.
+            When it has a "url", the build gets its REST API "url" too, which
+            other modules key builds by.
+    """
+    url = None
+    if pipeline is not None and pipeline.get("url"):
+        url = f"{pipeline['url']}/builds/{node.get('number')}"
+    return {
+        "id": node.get("uuid"),
+        "graphql_id": node.get("id"),
+        "url": url,
+        "number": node.get("number"),
+        "state": _lower(node.get("state")),
+        "branch": node.get("branch"),
+        "commit": node.get("commit"),
+        "message": node.get("message"),
+        "web_url": node.get("url"),
+        "created_at": node.get("createdAt"),
+        "scheduled_at": node.get("scheduledAt"),
+        "started_at": node.get("startedAt"),
+        "finished_at": node.get("finishedAt"),
+        "jobs": [rest_job(job) for job in _nodes(node.get("jobs"))],
+        "pipeline": pipeline,
+    }
+
+
+def rest_pipeline(node: dict, org_slug: str = None, endpoint: str = None) -> dict:
+    """Maps a GraphQL pipeline onto the shape returned by get_pipeline().
+
+    Args:
+        node: The GraphQL pipeline.
+
+        org_slug (OPTIONAL): The organization of the pipeline.
+
+        endpoint (OPTIONAL): The REST API's base URL, a client's endpoint.
+            With org_slug, the pipeline gets its REST API "url".
+    """
+    url = None
+    if org_slug is not None and endpoint is not None:
+        url = f"{endpoint}/v2/organizations/{org_slug}/pipelines/{node.get('slug')}"
+    return {
+        "id": node.get("uuid"),
+        "graphql_id": node.get("id"),
+        "url": url,
+        "slug": node.get("slug"),
+        "name": node.get("name"),
+        "description": node.get("description"),
+        "default_branch": node.get("defaultBranch"),
+        "web_url": node.get("url"),
+        "repository": (node.get("repository") or {}).get("url"),
+    }
+
+
+def _fetch_remaining_jobs(client: BuildkiteClient, builds: list):
+    """Completes the jobs of builds with more jobs than fit in one page.
+
+    Each round fetches the next page of jobs of up to JOBS_BATCH_SIZE
+    incomplete builds in a single query, with one aliased field per build.
+
+    Args:
+        builds: (build, cursor) pairs, where build is a REST-shaped build and
+            cursor is the end cursor of the jobs fetched so far.
+    """
+    while builds:
+        batch, builds = builds[:JOBS_BATCH_SIZE], builds[JOBS_BATCH_SIZE:]
+        arguments = ", ".join(
+            f"$build{index}: ID!, $after{index}: String" for index in range(len(batch))
+        )
+        fields = "\n".join(
+            f"""b{index}: build(uuid: $build{index}) {{
+                jobs(first: {JOBS_PAGE_SIZE}, after: $after{index}) {{
+                    pageInfo {{ hasNextPage endCursor }}
+                    edges {{ node {{ {_JOB_FIELDS} }} }}
+                }}
+            }}"""
+            for index in range(len(batch))
+        )
+        variables = {}
+        for index, (build, cursor) in enumerate(batch):
+            variables[f"build{index}"] = build["id"]
+            variables[f"after{index}"] = cursor
+        data = client.graphql(f"query RemainingJobs({arguments}) {{ {fields} }}", variables)
+        for index, (build, _) in enumerate(batch):
+            jobs = data[f"b{index}"]["jobs"]
+            build["jobs"].extend(rest_job(job) for job in _nodes(jobs))
+            if jobs["pageInfo"]["hasNextPage"]:
+                builds.append((build, jobs["pageInfo"]["endCursor"]))
+
+
+def list_pipelines_with_builds(
+    client: BuildkiteClient,
+    org_slug: str,
+    builds_per_pipeline: int = 1,
+    branch: str = None,
+    page_size: int = 20,
+    max_pages: int = None,
+) -> Iterator[dict]:
+    """Yields every pipeline of an organization with its latest builds and their jobs.
+
+    Args:
+        client: The client to send the GraphQL queries with.
+
+        org_slug: The organization slug is a simplified version of the
+            organisation name. You can find this within the full details of
+            an organization using list_organizations().
+
+        builds_per_pipeline: How many of the latest builds to include.
+
+        branch (OPTIONAL): Only include builds of this branch.
+
+        page_size: How many pipelines to fetch per request. Large pages of
+            builds with many jobs may exceed the API's query complexity limit.
+
+        max_pages (OPTIONAL): Stop after this many pages of pipelines.
+
+    Returns:
+        Iterator: REST-shaped pipelines, each with a "builds" list of
+            REST-shaped builds, newest first, including their "jobs".
+
+    Raises:
+        BuildkiteError: If a query failed.
+    """
+    variables = {
+        "org": org_slug,
+        "first": page_size,
+        "after": None,
+        "builds": builds_per_pipeline,
+        "branch": [branch] if branch is not None else None,
+    }
+    pages = 0
+    while True:
+        pipelines = client.graphql(_PIPELINES_QUERY, variables)["organization"]["pipelines"]
+        results = []
+        incomplete = []
+        for node in _nodes(pipelines):
+            pipeline = rest_pipeline(node, org_slug=org_slug, endpoint=client.endpoint)
+            summary = {
+                "id": pipeline["id"],
+                "url": pipeline["url"],
+                "slug": pipeline["slug"],
+                "name": pipeline["name"],
+            }
+            pipeline["builds"] = []
+            for build_node in _nodes(node.get("builds")):
+                build = rest_build(build_node, pipeline=summary)
+                pipeline["builds"].append(build)
+                jobs_page = build_node["jobs"]["pageInfo"]
+                if jobs_page["hasNextPage"]:
+                    incomplete.append((build, jobs_page["endCursor"]))
+            results.append(pipeline)
+        _fetch_remaining_jobs(client, incomplete)
+        yield from results
+
+        pages += 1
+        page_info = pipelines["pageInfo"]
+        if not page_info["hasNextPage"] or (max_pages is not None and pages >= max_pages):
+            return
+        variables["after"] = page_info["endCursor"]
@@ -0,0 +1,309 @@
+"""A local search index over job logs.
+
+LogIndex fetches the logs of finished jobs concurrently, strips the ANSI
+escape codes and Buildkite timestamp markers from them, and stores every line
+in a SQLite full-text index using the trigram tokenizer. Substring searches,
+and regular expressions with a literal part, are then answered from the
+index without downloading anything again. Jobs that are already indexed are
+skipped, so re-indexing a build only fetches the jobs that finished since.
+
+    index = LogIndex("logs.sqlite3")
+    index.index_build(buildkite_client, org_slug, "my-pipeline", "42")
+    for match in index.search("Connection reset by peer"):
+        print(match["build_number"], match["job_id"], match["line"])
+"""
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from main import BuildkiteClient, _json
+
+# Job states after which a job's log will not grow any more.
+FINISHED_JOB_STATES = {
+    "passed", "failed", "canceled", "timed_out", "skipped", "broken", "expired", "finished",
+}
+
+# CSI sequences (colours, cursor movement), and the APC and OSC sequences
+# Buildkite uses for timestamps (ESC _bk;t=1700000000000 BEL) and links.
+_ESCAPE_SEQUENCES = re.compile(
+    r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b_[^\x07]*\x07|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    org TEXT NOT NULL,
+    pipeline TEXT NOT NULL,
+    build_number INTEGER NOT NULL,
+    job_name TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5(
+    line, job_id UNINDEXED, line_number UNINDEXED, tokenize = 'trigram'
+);
+-- The lines of a job have consecutive rowids, so re-indexing a job can
+-- delete them by rowid rather than scanning the unindexed job_id column.
+CREATE TABLE IF NOT EXISTS job_lines (
+    job_id TEXT PRIMARY KEY,
+    first_rowid INTEGER NOT NULL,
+    last_rowid INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# A {m}, {m,} or {m,n} quantifier. Other braces are literal characters.
+_BRACE_QUANTIFIER = re.compile(r"\{(?:\d+(?:,\d*)?|,\d*)\}")
+
+
+def strip_log(content: str) -> str:
+    """Removes escape sequences and carriage-return overwrites from a log."""
+    content = _ESCAPE_SEQUENCES.sub("", content).replace("\r\n", "\n")
+    # Progress bars redraw a line with \r; keep only what was drawn last.
+    return "\n".join(line.rsplit("\r", 1)[-1] for line in content.split("\n"))
+
+
+def required_literal(pattern: str) -> str:
+    """Returns the longest plain substring every match of a regex must contain.
+
+    This is used to narrow a regex search down with the trigram index. Returns
+    an empty string when no such substring can be found.
+    """
+    if "|" in pattern:
+        return ""
+    runs = [""]
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\" and index + 1 < len(pattern):
+            escaped = pattern[index + 1]
+            if escaped.isalnum():
+                runs.append("")
+            else:
+                runs[-1] += escaped
+            index += 2
+            continue
+        if char in "*?" or (char == "{" and _BRACE_QUANTIFIER.match(pattern, index)):
+            # The previous character is optional or repeated.
+            runs[-1] = runs[-1][:-1]
+            runs.append("")
+            if char == "{":
+                index = pattern.index("}", index)
+        elif char == "+":
+            # The previous character occurs at least once, but what follows
+            # it is not adjacent to the run.
+            runs.append("")
+        elif char == "(":
+            # Groups may be optional or repeated, so skip them entirely.
+            depth = 0
+            while index < len(pattern):
+                if pattern[index] == "\\":
+                    index += 1
+                elif pattern[index] == "(":
+                    depth += 1
+                elif pattern[index] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                index += 1
+            runs.append("")
+        elif char in ".^$[]":
+            runs.append("")
+            if char == "[":
+                index = pattern.find("]", index + 2)
+                if index == -1:
+                    return ""
+        else:
+            runs[-1] += char
+        index += 1
+    return max(runs, key=len)
+
+
+class LogIndex:
+    """An on-disk trigram index of job log lines."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The SQLite database file, created if it does not exist.
+        """
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript(_SCHEMA)
+
+    def close(self):
+        self.__db.close()
+
+    def is_indexed(self, job_id: str) -> bool:
+        with self.__lock:
+            row = self.__db.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None
+
+    def add_log(
+        self,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number,
+        job: dict,
+        content: str,
+    ):
+        """Indexes, or re-indexes, the log of one job."""
+        lines = strip_log(content).split("\n")
+        rows = [(line, number) for number, line in enumerate(lines, start=1) if line.strip()]
+        with self.__lock, self.__db:
+            self.__delete_lines(job["id"])
+            first_rowid = (self.__db.execute("SELECT max(rowid) FROM lines").fetchone()[0] or 0) + 1
+            self.__db.execute(
+                "INSERT INTO job_lines VALUES (?, ?, ?)",
+                (job["id"], first_rowid, first_rowid + len(rows) - 1),
+            )
+            self.__db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                (job["id"], org_slug, pipeline_slug, int(build_number), job.get("name")),
+            )
+            self.__db.executemany(
+                "INSERT INTO lines (rowid, line, job_id, line_number) VALUES (?, ?, ?, ?)",
+                (
+                    (rowid, line, job["id"], number)
+                    for rowid, (line, number) in enumerate(rows, start=first_rowid)
+                ),
+            )
+
+    def __delete_lines(self, job_id: str):
+        """Deletes the indexed lines of a job, if it was indexed before."""
+        row = self.__db.execute(
+            "SELECT first_rowid, last_rowid FROM job_lines WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is not None:
+            self.__db.execute("DELETE FROM lines WHERE rowid BETWEEN ? AND ?", row)
+            self.__db.execute("DELETE FROM job_lines WHERE job_id = ?", (job_id,))
+        elif self.__db.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone():
+            # Indexed before job_lines existed.
+            self.__db.execute("DELETE FROM lines WHERE job_id = ?", (job_id,))
+
+    def index_build(
+        self,
+        client: BuildkiteClient,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        max_workers: int = 8,
+    ) -> int:
+        """Fetches and indexes the logs of a build's finished jobs.
+
+        Jobs that are already indexed, or have not finished yet, are skipped,
+        so calling this again as a build progresses only fetches new logs.
+
+        Returns:
+            int: The number of logs indexed.
+        """
+        build = _json(client.get_build(org_slug, pipeline_slug, build_number))
+        return self.index_builds(client, org_slug, [build], max_workers=max_workers)
+
+    def index_builds(
+        self,
+        client: BuildkiteClient,
+        org_slug: str,
+        builds,
+        max_workers: int = 8,
+    ) -> int:
+        """Fetches and indexes the logs of the finished jobs of many builds.
+
+        Args:
+            client: The client to fetch logs with.
+
+            org_slug: The organization the builds belong to.
+
+            builds: Decoded builds, for example from client.iterate() over one
+                of the list_*_builds functions.
+
+            max_workers: The number of logs fetched concurrently.
+
+        Returns:
+            int: The number of logs indexed.
+        """
+        pending = []
+        for build in builds:
+            pipeline_slug = build["pipeline"]["slug"]
+            for job in build.get("jobs", []):
+                if (
+                    job.get("type") == "script"
+                    and job.get("state") in FINISHED_JOB_STATES
+                    and not self.is_indexed(job["id"])
+                ):
+                    pending.append((pipeline_slug, build["number"], job))
+
+        def fetch(item):
+            pipeline_slug, build_number, job = item
+            log = _json(
+                client.get_job_log(org_slug, pipeline_slug, str(build_number), job["id"])
+            )
+            self.add_log(org_slug, pipeline_slug, build_number, job, log.get("content") or "")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _ in executor.map(fetch, pending):
+                pass
+        return len(pending)
+
+    def search(
+        self,
+        pattern: str,
+        regex: bool = False,
+        pipeline_slug: str = None,
+        limit: int = 100,
+    ) -> list:
+        """Searches indexed log lines.
+
+        Args:
+            pattern: The substring, or regular expression, to look for.
+                Substring searches are case-sensitive.
+
+            regex: Treat pattern as a regular expression. Expressions with a
+                literal part of three or more characters use the index; others
+                scan every line.
+
+            pipeline_slug (OPTIONAL): Only search logs of this pipeline.
+
+            limit: The maximum number of matching lines to return.
+
+        Returns:
+            list: Dicts with the "org", "pipeline", "build_number", "job_id",
+                "job_name", "line_number" and "line" of each match.
+        """
+        literal = required_literal(pattern) if regex else pattern
+        matches = re.compile(pattern).search if regex else (lambda line: pattern in line)
+
+        query = (
+            "SELECT jobs.org, jobs.pipeline, jobs.build_number, jobs.job_id, jobs.job_name,"
+            " lines.line_number, lines.line FROM lines JOIN jobs USING (job_id)"
+        )
+        args = []
+        conditions = []
+        if len(literal) >= 3:
+            conditions.append("lines MATCH ?")
+            args.append('"' + literal.replace('"', '""') + '"')
+        if pipeline_slug is not None:
+            conditions.append("jobs.pipeline = ?")
+            args.append(pipeline_slug)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        results = []
+        with self.__lock:
+            for org, pipeline, build_number, job_id, job_name, line_number, line in (
+                self.__db.execute(query, args)
+            ):
+                if not matches(line):
+                    continue
+                results.append(
+                    {
+                        "org": org,
+                        "pipeline": pipeline,
+                        "build_number": build_number,
+                        "job_id": job_id,
+                        "job_name": job_name,
+                        "line_number": line_number,
+                        "line": line,
+                    }
+                )
+                if len(results) >= limit:
+                    break
+        return results
@@ -1,34 +1,819 @@
 """ TODO: Module docstring."""
+# Only lightweight modules are imported here, so that short-lived scripts can
+# import this module quickly. requests is imported the first time a request is
+# sent, and the optional subsystems in the sibling modules are imported the
+# first time one of their names is looked up on this module.
+from __future__ import annotations
+
+import heapq
+import importlib
 import json
-import logging
-from typing import Callable
-import requests
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Iterator
+
+if TYPE_CHECKING:
+    import requests
+
+    from cache import TerminalBuildCache
+
+    # Defined on first use by _get_session_class().
+    BuildkiteSession = requests.Session
+
+# Names that can be imported from this module but live in a sibling module.
+_LAZY_ATTRIBUTES = {
+    "BuildkiteState": "webhooks",
+    "BuildkiteWebhookReceiver": "webhooks",
+    "CassetteAdapter": "cassette",
+    "cassette_session": "cassette",
+    "sync_pipelines": "pipelines",
+    "BuildTable": "analytics",
+    "JobTable": "analytics",
+    "FlakyIndex": "flaky",
+    "tables_from_builds": "analytics",
+    "TerminalBuildCache": "cache",
+    "list_pipelines_with_builds": "graphql_api",
+    "LogIndex": "logindex",
+    "LogArchive": "archive",
+    "drain_agents": "agents",
+    "crawl_builds": "crawl",
+    "map_pages": "crawl",
+    "ArtifactCache": "artifact_cache",
+    "EmojiTable": "render",
+    "LogRenderer": "render",
+    "render_job_log": "render",
+}
+
+_session_class_lock = threading.Lock()
+_session_class = None
+
+
+def __getattr__(name: str):
+    if name == "BuildkiteSession":
+        return _get_session_class()
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class BuildkiteError(Exception):
     """TODO: Class docstring."""
 
 
-class BuildkiteSession(requests.Session):
-    """TODO: Class docstring."""
+def _get_session_class() -> type:
+    """Defines BuildkiteSession on first use, as it subclasses requests.Session."""
+    global _session_class
+    with _session_class_lock:
+        if _session_class is None:
+            import requests
 
-    def init_basic_auth(self, api_access_token: str):
-        """TODO: Function docstring."""
-        self.headers.update(
-            {
-                "Authorization": f"Bearer {api_access_token}",
-            }
+            class BuildkiteSession(requests.Session):
+                """TODO: Class docstring."""
+
+                def init_basic_auth(self, api_access_token: str):
+                    """TODO: Function docstring."""
+                    self.headers.update(
+                        {
+                            "Authorization": f"Bearer {api_access_token}",
+                        }
+                    )
+
+            BuildkiteSession.__qualname__ = "BuildkiteSession"
+            _session_class = BuildkiteSession
+    return _session_class
+
+# Request priorities, highest first. See request_priority().
+PRIORITIES = ("interactive", "normal", "bulk")
+
+_priority = threading.local()
+
+
+@contextmanager
+def request_priority(priority: str):
+    """Sends the requests the current thread makes within the block at a priority.
+
+    Under an AdaptiveConcurrencyLimit, waiting "interactive" requests are sent
+    before "normal" ones, and those before "bulk" ones. Bulk requests are also
+    kept out of a reserved share of the concurrency limit and of the rate
+    limit budget, so they only use capacity that is left over:
+
+        with request_priority("bulk"):
+            crawl_history()
+    """
+    if priority not in PRIORITIES:
+        raise BuildkiteError(f"Unknown request priority {priority!r}; use one of {PRIORITIES}.")
+    previous = getattr(_priority, "value", "normal")
+    _priority.value = priority
+    try:
+        yield
+    finally:
+        _priority.value = previous
+
+
+def current_priority() -> str:
+    """Returns the priority requests from the current thread are sent at."""
+    return getattr(_priority, "value", "normal")
+
+
+def _carry_priority(func: Callable) -> Callable:
+    """Wraps func to run at the calling thread's priority, on any thread."""
+    priority = current_priority()
+
+    def call(*args, **kwargs):
+        with request_priority(priority):
+            return func(*args, **kwargs)
+
+    return call
+
+
+class RateLimitBudget:
+    """Tracks the REST API rate limit for a single API access token.
+
+    Buildkite reports the remaining request budget through the
+    RateLimit-Remaining and RateLimit-Reset response headers. Every client
+    sharing a token should share one budget so that, once it is spent, calls
+    wait for the window to reset instead of being rejected with a 429.
+    """
+
+    def __init__(self, bulk_reserve: float = 0.25):
+        """
+        Args:
+            bulk_reserve: The share of each window's budget that "bulk"
+                priority requests may not spend.
+        """
+        self.__lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.bulk_reserve = bulk_reserve
+
+    def __take(self, priority: str) -> float:
+        """Takes a request from the budget, or returns how long until it allows one."""
+        with self.__lock:
+            now = time.monotonic()
+            reserved = 0
+            if priority == "bulk" and self.limit is not None:
+                reserved = int(self.limit * self.bulk_reserve)
+            if self.remaining is None or self.remaining > reserved or now >= self.reset_at:
+                if self.remaining is not None:
+                    self.remaining -= 1
+                return None
+            return self.reset_at - now
+
+    def acquire(self, priority: str = "normal"):
+        """Blocks until the budget allows another request to be sent."""
+        while True:
+            delay = self.__take(priority)
+            if delay is None:
+                return
+            time.sleep(delay)
+
+    def try_acquire(self, priority: str = "normal") -> bool:
+        """Returns whether the budget allows another request now, without waiting."""
+        return self.__take(priority) is None
+
+    def update(self, response: requests.Response):
+        """Refreshes the budget from the rate limit headers of a response."""
+        remaining = response.headers.get("RateLimit-Remaining")
+        reset = response.headers.get("RateLimit-Reset")
+        limit = response.headers.get("RateLimit-Limit")
+        with self.__lock:
+            if limit is not None:
+                self.limit = int(limit)
+            if remaining is not None:
+                self.remaining = int(remaining)
+            elif response.status_code == 429:
+                self.remaining = 0
+            if reset is not None:
+                self.reset_at = time.monotonic() + int(reset)
+
+
+class AdaptiveConcurrencyLimit:
+    """Limits how many requests are in flight at once, adapting the limit (AIMD).
+
+    While responses are healthy and fast, the limit grows additively, by
+    about one request per round trip. A 429, a 5xx, a connection error, or a
+    latency more than latency_tolerance times the best recent latency of the
+    same endpoint cuts it multiplicatively, at most once per round trip. Share one limit between
+    every client using the same token, like RateLimitBudget; since requests
+    wait for it in the client, every thread pool built on the client is
+    throttled without having to pick a thread count.
+
+    Waiting requests are let through by priority (see request_priority()),
+    and "bulk" requests may only use the part of the limit not held back by
+    bulk_reserve.
+    """
+
+    def __init__(
+        self,
+        initial: int = 8,
+        minimum: int = 1,
+        maximum: int = 64,
+        latency_tolerance: float = 2.0,
+        backoff: float = 0.5,
+        bulk_reserve: float = 0.25,
+    ):
+        """
+        Args:
+            initial: The limit to start with.
+
+            minimum: The limit is never cut below this.
+
+            maximum: The limit never grows beyond this.
+
+            latency_tolerance: How many times the best recent latency of its
+                endpoint a response may take before the limit is cut.
+
+            backoff: The factor the limit is multiplied by when it is cut.
+
+            bulk_reserve: The share of the limit that "bulk" priority requests
+                may not use, so that others can be sent without waiting.
+        """
+        self.__condition = threading.Condition()
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.bulk_reserve = bulk_reserve
+        self.in_flight = 0
+        self.waiting = dict.fromkeys(PRIORITIES, 0)
+        # The best recent latency of each endpoint template, since endpoints
+        # differ too much in speed to share one.
+        self.baseline_latencies = {}
+        self.__last_decrease = 0.0
+
+    def __may_send(self, priority: str) -> bool:
+        limit = int(self.limit)
+        if priority == "bulk":
+            limit = max(1, int(self.limit * (1 - self.bulk_reserve)))
+        if self.in_flight >= limit:
+            return False
+        # Requests of a higher priority that are waiting go first.
+        higher = PRIORITIES[: PRIORITIES.index(priority)]
+        return not any(self.waiting[other] for other in higher)
+
+    def acquire(self, priority: str = "normal") -> float:
+        """Blocks until another request may be sent, and returns the time it was sent."""
+        with self.__condition:
+            self.waiting[priority] += 1
+            try:
+                while not self.__may_send(priority):
+                    self.__condition.wait()
+            finally:
+                self.waiting[priority] -= 1
+            self.in_flight += 1
+        return time.monotonic()
+
+    def try_acquire(self, priority: str = "normal") -> float:
+        """Like acquire(), but returns None at once if a request may not be sent now."""
+        with self.__condition:
+            if not self.__may_send(priority):
+                return None
+            self.in_flight += 1
+        return time.monotonic()
+
+    def cancel(self):
+        """Gives back a slot taken by acquire() for a request that was not sent."""
+        with self.__condition:
+            self.in_flight -= 1
+            self.__condition.notify_all()
+
+    def release(
+        self, started: float, response: requests.Response = None, endpoint: str = None
+    ) -> dict:
+        """Records the outcome of a request sent after acquire().
+
+        Args:
+            started: The time returned by acquire().
+
+            response (OPTIONAL): The response, or None if the request failed
+                without one.
+
+            endpoint (OPTIONAL): The endpoint_template() of the request, which
+                its latency is compared within.
+
+        Returns:
+            dict: The "decision" taken ("increase", "decrease" or "hold"), the
+                "reason" for it, the new "limit", and the request's "latency".
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self.__condition:
+            saturated = self.in_flight >= int(self.limit) // 2
+            self.in_flight -= 1
+            baseline = self.baseline_latencies.get(endpoint)
+
+            if response is None:
+                reason = "error"
+            elif response.status_code == 429 or response.status_code >= 500:
+                reason = f"status {response.status_code}"
+            else:
+                if baseline is not None and latency > self.latency_tolerance * baseline:
+                    reason = "latency"
+                else:
+                    reason = None
+                # The baseline follows the best latency, drifting up slowly so
+                # that a lasting change in the endpoint's speed is picked up.
+                if baseline is None or latency < baseline:
+                    self.baseline_latencies[endpoint] = latency
+                else:
+                    self.baseline_latencies[endpoint] = baseline + (latency - baseline) * 0.02
+
+            round_trip = baseline or latency
+            if reason is not None and now - self.__last_decrease >= round_trip:
+                decision = "decrease"
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.__last_decrease = now
+            elif reason is None and saturated and self.limit < self.maximum:
+                decision, reason = "increase", "healthy"
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                decision = "hold"
+                reason = reason or ("maximum" if self.limit >= self.maximum else "idle")
+            self.__condition.notify_all()
+            return {"decision": decision, "reason": reason, "limit": int(self.limit), "latency": latency}
+
+
+def endpoint_template(url: str) -> str:
+    """Returns the endpoint a URL calls, with IDs and slugs replaced by "*".
+
+    For example ".../v2/organizations/acme/pipelines/app/builds/42" becomes
+    "organizations/*/pipelines/*/builds/*".
+    """
+    path = url.split("://", 1)[-1].split("?", 1)[0]
+    segments = path.split("/")[1:]
+    if segments and segments[0] in ("v1", "v2"):
+        segments = segments[1:]
+    return "/".join("*" if index % 2 else segment for index, segment in enumerate(segments))
+
+
+def _matches_template(template: str, patterns) -> bool:
+    from fnmatch import fnmatchcase
+
+    return patterns is None or any(fnmatchcase(template, pattern) for pattern in patterns)
+
+
+class HedgingPolicy:
+    """Decides when to send a second copy of a slow GET request.
+
+    If a GET has not completed after the given percentile of the recent
+    latencies of its endpoint, a second attempt is sent, and whichever
+    response arrives first is used. The slower one is discarded when it
+    arrives. At most max_extra hedges are sent per request, on average, so
+    hedging cannot multiply the load on a struggling API, and a hedge is
+    only sent when the client's rate limit budget and concurrency limit
+    allow another request straight away.
+    """
+
+    def __init__(
+        self,
+        templates: list = None,
+        percentile: float = 95,
+        min_delay: float = 0.01,
+        max_delay: float = 5.0,
+        window: int = 200,
+        min_samples: int = 20,
+        max_extra: float = 0.1,
+    ):
+        """
+        Args:
+            templates (OPTIONAL): Shell-style patterns of the endpoint
+                templates to hedge, as returned by endpoint_template(), for
+                example ["organizations/*/pipelines/*/builds/*"]. Defaults to
+                every GET.
+
+            percentile: The percentile of recent latencies to hedge after.
+
+            min_delay: Never hedge sooner than this many seconds.
+
+            max_delay: Never wait longer than this many seconds to hedge.
+
+            window: How many recent latencies per endpoint to keep.
+
+            min_samples: Do not hedge an endpoint until this many latencies
+                have been seen.
+
+            max_extra: The most hedges to send per request, on average.
+        """
+        self.templates = templates
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.max_extra = max_extra
+        self.__lock = threading.Lock()
+        self.__latencies = {}
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def applies_to(self, template: str) -> bool:
+        return _matches_template(template, self.templates)
+
+    def delay(self, template: str) -> float:
+        """Returns how long to wait before hedging a request, or None to not hedge."""
+        with self.__lock:
+            self.requests += 1
+            latencies = self.__latencies.get(template)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            if self.hedges >= self.max_extra * self.requests:
+                return None
+            ordered = sorted(latencies)
+        position = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return min(self.max_delay, max(self.min_delay, ordered[position]))
+
+    def record(self, template: str, latency: float):
+        """Records the latency of a completed attempt."""
+        from collections import deque
+
+        with self.__lock:
+            latencies = self.__latencies.get(template)
+            if latencies is None:
+                latencies = self.__latencies[template] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def record_hedge(self, won: bool):
+        with self.__lock:
+            self.hedges += 1
+            self.hedges_won += won
+
+
+class CircuitBreaker:
+    """Fails calls to an endpoint fast while it is clearly failing.
+
+    Each endpoint template has its own circuit. When at least
+    failure_threshold of the calls in the last window seconds failed with a
+    5xx or a connection error, out of at least minimum_calls, the circuit
+    opens and calls raise BuildkiteError without being sent. After open_for
+    seconds one trial call is let through: if it succeeds the circuit closes,
+    otherwise it opens again.
+    """
+
+    def __init__(
+        self,
+        templates: list = None,
+        failure_threshold: float = 0.5,
+        minimum_calls: int = 20,
+        window: float = 30.0,
+        open_for: float = 10.0,
+    ):
+        """
+        Args:
+            templates (OPTIONAL): Shell-style patterns of the endpoint
+                templates this breaker covers, as returned by
+                endpoint_template(). Defaults to every endpoint.
+
+            failure_threshold: The share of failed calls that opens a circuit.
+
+            minimum_calls: A circuit never opens on fewer calls than this.
+
+            window: How many seconds of calls the failure share is taken over.
+
+            open_for: How many seconds an open circuit rejects calls for.
+        """
+        self.templates = templates
+        self.failure_threshold = failure_threshold
+        self.minimum_calls = minimum_calls
+        self.window = window
+        self.open_for = open_for
+        self.__lock = threading.Lock()
+        self.__calls = {}
+        self.__opened_at = {}
+        self.__trial = set()
+
+    def applies_to(self, template: str) -> bool:
+        return _matches_template(template, self.templates)
+
+    def state(self, template: str) -> str:
+        """Returns "closed", "open" or "half-open" for an endpoint template."""
+        with self.__lock:
+            return self.__state(template, time.monotonic())
+
+    def __state(self, template: str, now: float) -> str:
+        opened_at = self.__opened_at.get(template)
+        if opened_at is None:
+            return "closed"
+        if now - opened_at < self.open_for or template in self.__trial:
+            return "open"
+        return "half-open"
+
+    def before(self, template: str):
+        """Raises BuildkiteError if calls to the endpoint should not be sent now."""
+        with self.__lock:
+            state = self.__state(template, time.monotonic())
+            if state == "half-open":
+                self.__trial.add(template)
+            elif state == "open":
+                raise BuildkiteError(
+                    f"CircuitBreaker: calls to {template} are failing; not sending this one."
+                )
+
+    def record(self, template: str, failed: bool) -> str:
+        """Records the outcome of a call, and returns the circuit's new state
+        if it changed, or None."""
+        from collections import deque
+
+        now = time.monotonic()
+        with self.__lock:
+            if template in self.__trial:
+                self.__trial.discard(template)
+                if failed:
+                    self.__opened_at[template] = now
+                    return "open"
+                del self.__opened_at[template]
+                self.__calls.pop(template, None)
+                return "closed"
+
+            calls = self.__calls.get(template)
+            if calls is None:
+                calls = self.__calls[template] = deque()
+            calls.append((now, failed))
+            while calls and calls[0][0] < now - self.window:
+                calls.popleft()
+            if template in self.__opened_at or len(calls) < self.minimum_calls:
+                return None
+            failures = sum(1 for _, call_failed in calls if call_failed)
+            if failures >= self.failure_threshold * len(calls):
+                self.__opened_at[template] = now
+                calls.clear()
+                return "open"
+            return None
+
+
+def _as_tuple(policies) -> tuple:
+    if policies is None:
+        return ()
+    if isinstance(policies, (list, tuple)):
+        return tuple(policies)
+    return (policies,)
+
+
+def _first_applying(policies: tuple, template: str):
+    return next((policy for policy in policies if policy.applies_to(template)), None)
+
+
+def _discard_response(future):
+    """Closes the response of an attempt that lost a hedged race."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _json(response: requests.Response):
+    """Decodes a response body, raising BuildkiteError for failed calls."""
+    if not response.ok:
+        raise BuildkiteError(
+            f"{response.request.method} {response.url} failed with "
+            f"{response.status_code}: {response.text[:200]}"
         )
+    return response.json()
 
 
 class BuildkiteClient:
-    """TODO: Class docstring."""
-    def __init__(self, api_access_token: str):
-        # Initialize the session.
-        self.__session = BuildkiteSession()
+    """A client for the Buildkite REST API.
+
+    Concurrent use: a single client may be shared by any number of threads.
+    The headers sent with every request, including the token, are fixed when
+    the client is created and never modified afterwards; per-call headers are
+    merged into a new dictionary for each request. Each thread sends through
+    its own session, so no requests.Session state is shared between threads,
+    but every one of those sessions uses the same transport adapters, so all
+    threads share one connection pool. Size the pool with pool_maxsize to
+    roughly the number of threads that call the client at once.
+    """
+    def __init__(
+        self,
+        api_access_token: str,
+        session: BuildkiteSession = None,
+        budget: RateLimitBudget = None,
+        endpoint: str = "https://api.buildkite.com",
+        pool_maxsize: int = None,
+        coalesce_window: float = None,
+        cache: TerminalBuildCache = None,
+        concurrency: AdaptiveConcurrencyLimit = None,
+        hedging=None,
+        circuit_breakers=None,
+        detailed_timing: bool = False,
+        graphql_endpoint: str = "https://graphql.buildkite.com/v1",
+    ):
+        """
+        Args:
+            api_access_token: The Buildkite API access token.
+
+            session (OPTIONAL): A session whose settings and transport adapters
+                requests are sent through. Sharing one session between clients
+                shares its connection pool. The token is always sent per
+                request rather than stored on the session.
+
+            budget (OPTIONAL): The rate limit budget for this token. Clients
+                using the same token should share the same budget.
+
+            endpoint (OPTIONAL): The base URL of the API, for example a local
+                mock server.
+
+            pool_maxsize (OPTIONAL): The number of connections to keep open
+                per host, when the client creates its own session.
+
+            coalesce_window (OPTIONAL): Merge identical create_build() calls
+                made while one is in flight, or up to this many seconds after
+                it completed, into a single API call. Off by default.
+
+            cache (OPTIONAL): A TerminalBuildCache that answers repeat reads of
+                finished builds, and their artifacts and annotations, without
+                calling the API.
+
+            concurrency (OPTIONAL): An AdaptiveConcurrencyLimit that requests
+                wait for before being sent. Clients using the same token should
+                share the same limit.
+
+            hedging (OPTIONAL): A HedgingPolicy, or a list of them for different
+                endpoint templates, for hedging slow GET requests. The first
+                policy that applies to an endpoint is used.
+
+            circuit_breakers (OPTIONAL): A CircuitBreaker, or a list of them for
+                different endpoint templates. The first breaker that applies to
+                an endpoint is used.
+
+            detailed_timing: Record how long each request spent resolving the
+                host, connecting, in the TLS handshake, waiting for the first
+                byte and transferring the body, and whether its connection was
+                reused, as response.timing (see timing.py). Only applies when
+                the client creates its own session.
+
+            graphql_endpoint (OPTIONAL): The URL of the GraphQL API, for
+                example a local stand-in server.
+        """
+        # The session is only initialized when the first request is sent.
+        self.__session = session
+        self.__owns_session = session is None
+        self.__pool_maxsize = pool_maxsize
+        self.__detailed_timing = detailed_timing
+        self.__session_lock = threading.Lock()
+        self.__local = threading.local()
+        self.__auth_headers = types.MappingProxyType(
+            {"Authorization": f"Bearer {api_access_token}"}
+        )
 
-        self.__session.init_basic_auth(api_access_token)
-        self.__endpoint = "https://api.buildkite.com"
+        self.__budget = budget
+        self.__endpoint = endpoint.rstrip("/")
+        self.__graphql_endpoint = graphql_endpoint
+        self.__executor = None
+        self.__coalesce_window = coalesce_window
+        self.__coalesce_lock = threading.Lock()
+        self.__pending_builds = {}
+        self.__cache = cache
+        self.__concurrency = concurrency
+        self.__listeners = ()
+        self.__hedging = _as_tuple(hedging)
+        self.__hedge_executor = None
+        self.__circuit_breakers = _as_tuple(circuit_breakers)
+
+    def __get_session(self) -> BuildkiteSession:
+        """Returns the calling thread's session, creating it on first use.
+
+        Each thread's session is a copy of the shared session's settings, with
+        the very same transport adapters mounted, so that connections are
+        pooled across threads while sessions themselves are never shared.
+        """
+        session = getattr(self.__local, "session", None)
+        if session is not None:
+            return session
+
+        with self.__session_lock:
+            if self.__session is None:
+                self.__session = _get_session_class()()
+                if self.__pool_maxsize is not None or self.__detailed_timing:
+                    if self.__detailed_timing:
+                        from timing import TimingAdapter as HTTPAdapter
+                    else:
+                        from requests.adapters import HTTPAdapter
+
+                    adapter = HTTPAdapter(pool_maxsize=self.__pool_maxsize or 10)
+                    self.__session.mount("https://", adapter)
+                    self.__session.mount("http://", adapter)
+            shared = self.__session
+
+        session = _get_session_class()()
+        for adapter in session.adapters.values():
+            adapter.close()
+        session.adapters = shared.adapters.copy()
+        session.headers = shared.headers.copy()
+        session.auth = shared.auth
+        session.proxies = shared.proxies.copy()
+        session.verify = shared.verify
+        session.cert = shared.cert
+        session.trust_env = shared.trust_env
+        session.max_redirects = shared.max_redirects
+        self.__local.session = session
+        return session
+
+    @property
+    def endpoint(self) -> str:
+        """The base URL of the REST API, without the version."""
+        return self.__endpoint
+
+    def close(self):
+        """Shuts down the client's worker pool and closes its connections.
+
+        A session passed in by the caller is left open for the caller to close.
+        """
+        with self.__session_lock:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+                self.__executor = None
+            if self.__hedge_executor is not None:
+                self.__hedge_executor.shutdown()
+                self.__hedge_executor = None
+            if self.__session is not None and self.__owns_session:
+                self.__session.close()
+
+    def add_listener(self, callback: Callable):
+        """Calls callback(event, details) for every instrumentation event.
+
+        Events:
+            "request": after every request, with its "method", "url",
+                "status" (None if it failed without a response), "elapsed"
+                seconds, whether it was "cached", and its "timing" breakdown
+                when detailed_timing is on (otherwise None).
+
+            "concurrency": after every request sent under an
+                AdaptiveConcurrencyLimit, with the "decision" taken, its
+                "reason", the new "limit" and the request's "latency".
+
+            "hedge": when a second attempt of a slow GET was sent, with the
+                endpoint "template", the "delay" it was sent after, and the
+                "winner" ("primary" or "hedge").
+
+            "circuit": when a circuit breaker changes the "state" of the
+                circuit of an endpoint "template", or "rejected" a call.
+
+        Callbacks run on the thread that made the request, so they should be
+        quick.
+        """
+        with self.__session_lock:
+            self.__listeners = (*self.__listeners, callback)
+
+    def remove_listener(self, callback: Callable):
+        with self.__session_lock:
+            self.__listeners = tuple(
+                listener for listener in self.__listeners if listener is not callback
+            )
+
+    def __emit(self, event: str, details: dict):
+        for listener in self.__listeners:
+            listener(event, details)
+
+    def __get_executor(self):
+        """Returns the worker pool used by composite calls, creating it on first use."""
+        if self.__executor is None:
+            with self.__session_lock:
+                if self.__executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+
+                    self.__executor = ThreadPoolExecutor(
+                        max_workers=8, thread_name_prefix="buildkite-client"
+                    )
+        return self.__executor
+
+    def __coalesced(self, key: str, call: Callable) -> requests.Response:
+        """Makes call() once for every caller using the same key at the same time.
+
+        The first caller makes the call, and everyone else with the same key
+        waits for and receives the same response, until coalesce_window
+        seconds after it completed. Failed calls are not reused.
+        """
+        from concurrent.futures import Future
+
+        now = time.monotonic()
+        with self.__coalesce_lock:
+            for pending_key, (completed_at, _) in list(self.__pending_builds.items()):
+                if completed_at is not None and now - completed_at > self.__coalesce_window:
+                    del self.__pending_builds[pending_key]
+            pending = self.__pending_builds.get(key)
+            if pending is None:
+                future = Future()
+                self.__pending_builds[key] = (None, future)
+        if pending is not None:
+            return pending[1].result()
+
+        try:
+            resp = call()
+        except BaseException as error:
+            with self.__coalesce_lock:
+                del self.__pending_builds[key]
+            future.set_exception(error)
+            raise
+        with self.__coalesce_lock:
+            if resp.ok:
+                self.__pending_builds[key] = (time.monotonic(), future)
+            else:
+                del self.__pending_builds[key]
+        future.set_result(resp)
+        return resp
 
     def __request(
         self,
@@ -38,6 +823,7 @@ class BuildkiteClient:
         params: dict = None,
         data: dict = None,
         headers: dict = None,
+        stream: bool = False,
     ) -> requests.Response:
         """Basic function to remove this snippet of code out of every other
         function.
@@ -57,6 +843,9 @@ class BuildkiteClient:
 
             headers: any extra headers to add to the base auth headers.
 
+            stream: whether to leave the body to be read with iter_content()
+                rather than downloading it straight away.
+
         Returns:
             requests.Response: The response from the API call.
         """
@@ -78,23 +867,286 @@ class BuildkiteClient:
         if headers is None:
             headers = {}
 
-        req = requests.Request(
+        return self.__send(
             method=method,
             url=f"{self.__endpoint}/v{version}/{path}",
             params=params,
             data=data,
             headers=headers,
+            stream=stream,
+        )
+
+    def __send(
+        self,
+        method: str,
+        url: str,
+        params: dict = None,
+        data: dict = None,
+        headers: dict = None,
+        stream: bool = False,
+    ) -> requests.Response:
+        """Sends a request to an absolute URL using the client's credentials.
+
+        This is shared by __request and the pagination helpers, which follow
+        the absolute URLs given in the Link header.
+
+        Returns:
+            requests.Response: The response from the API call.
+        """
+        import requests
+
+        req = requests.Request(
+            method=method,
+            url=url,
+            params=params,
+            data=data,
+            headers={**self.__auth_headers, **(headers or {})},
         )
 
         # If any data is being passed, it will need to have the Content-Type header set.
         if data is not None:
             req.headers["Content-Type"] = "application/json"
 
+        session = self.__get_session()
+        prep = session.prepare_request(req)
+        template = endpoint_template(prep.url)
+
+        # Finished builds are answered from the cache; any write to a build
+        # may change it, so it is forgotten before the write is sent.
+        if self.__cache is not None:
+            if method == "GET" and not stream:
+                cached = self.__cache.get(prep.url)
+                if cached is not None:
+                    cached.request = prep
+                    self.__emit(
+                        "request",
+                        {
+                            "method": method,
+                            "url": prep.url,
+                            "status": cached.status_code,
+                            "elapsed": 0.0,
+                            "cached": True,
+                            "timing": None,
+                        },
+                    )
+                    return cached
+            elif method != "GET":
+                self.__cache.invalidate_url(prep.url)
+
+        # Fail fast while the endpoint's circuit is open.
+        breaker = _first_applying(self.__circuit_breakers, template)
+        if breaker is not None:
+            try:
+                breaker.before(template)
+            except BuildkiteError:
+                self.__emit("circuit", {"template": template, "state": "open", "rejected": True})
+                raise
+
+        hedging = None
+        if method == "GET" and not stream:
+            hedging = _first_applying(self.__hedging, template)
+
+        # Wait for the token's rate limit budget, if one is being tracked.
+        priority = current_priority()
+        if self.__budget is not None:
+            self.__budget.acquire(priority)
+
+        # Wait for a slot under the adaptive concurrency limit, if one is set.
+        if self.__concurrency is not None:
+            started = self.__concurrency.acquire(priority)
+        else:
+            started = time.monotonic()
+
         # Execute the request, and return the JSON payload.
-        prep = self.__session.prepare_request(req)
-        resp = self.__session.send(prep)
+        resp = None
+        try:
+            if hedging is not None:
+                resp = self.__send_hedged(session, prep, template, hedging)
+            else:
+                resp = session.send(prep, stream=stream)
+        finally:
+            if self.__concurrency is not None:
+                self.__emit("concurrency", self.__concurrency.release(started, resp, template))
+            if breaker is not None:
+                state = breaker.record(template, resp is None or resp.status_code >= 500)
+                if state is not None:
+                    self.__emit("circuit", {"template": template, "state": state, "rejected": False})
+            self.__emit(
+                "request",
+                {
+                    "method": method,
+                    "url": prep.url,
+                    "status": None if resp is None else resp.status_code,
+                    "elapsed": time.monotonic() - started,
+                    "cached": False,
+                    "timing": getattr(resp, "timing", None),
+                },
+            )
+
+        if self.__budget is not None:
+            self.__budget.update(resp)
+        if self.__cache is not None and method == "GET" and not stream:
+            self.__cache.put(prep.url, resp)
         return resp
 
+    def __send_hedged(
+        self, session, prep, template: str, policy: HedgingPolicy
+    ) -> requests.Response:
+        """Sends a GET, and a second copy of it if the first one is slow.
+
+        Both attempts run on the hedging worker pool, each through that
+        worker's own session. The first good response is returned and the
+        other one is closed when it arrives. The second attempt is a request
+        of its own: it is only sent if the rate limit budget and the
+        concurrency limit allow it straight away, and is accounted against
+        them like any other request.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        def attempt(attempt_session=None, hedge_started=None):
+            started = time.monotonic()
+            response = None
+            try:
+                response = (attempt_session or self.__get_session()).send(prep.copy())
+            finally:
+                if hedge_started is not None:
+                    self.__emit(
+                        "concurrency",
+                        self.__concurrency.release(hedge_started, response, template),
+                    )
+            policy.record(template, time.monotonic() - started)
+            return response
+
+        def hedge_attempt(hedge_started=None):
+            response = attempt(hedge_started=hedge_started)
+            if self.__budget is not None:
+                self.__budget.update(response)
+            return response
+
+        delay = policy.delay(template)
+        if delay is None:
+            return attempt(session)
+
+        if self.__hedge_executor is None:
+            with self.__session_lock:
+                if self.__hedge_executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+
+                    self.__hedge_executor = ThreadPoolExecutor(
+                        max_workers=32, thread_name_prefix="buildkite-hedge"
+                    )
+        primary = self.__hedge_executor.submit(attempt)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # Only hedge if another request may be sent right now.
+        priority = current_priority()
+        hedge_started = None
+        if self.__concurrency is not None:
+            hedge_started = self.__concurrency.try_acquire(priority)
+            if hedge_started is None:
+                return primary.result()
+        if self.__budget is not None and not self.__budget.try_acquire(priority):
+            if hedge_started is not None:
+                self.__concurrency.cancel()
+            return primary.result()
+
+        hedge = self.__hedge_executor.submit(hedge_attempt, hedge_started)
+        pending = [primary, hedge]
+        while True:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            # Prefer an attempt that succeeded over one that failed.
+            winner = next(
+                (
+                    future
+                    for future in pending
+                    if future in done
+                    and future.exception() is None
+                    and future.result().status_code < 500
+                ),
+                None,
+            )
+            if winner is None and len(done) < len(pending):
+                pending = [future for future in pending if future not in done]
+                continue
+            if winner is None:
+                winner = primary
+            break
+
+        for future in (primary, hedge):
+            if future is not winner:
+                future.add_done_callback(_discard_response)
+        policy.record_hedge(winner is hedge)
+        self.__emit(
+            "hedge",
+            {
+                "template": template,
+                "delay": delay,
+                "winner": "hedge" if winner is hedge else "primary",
+            },
+        )
+        return winner.result()
+
+    # Pagination
+    # https://buildkite.com/docs/apis/rest-api#pagination
+
+    # List endpoints are paginated. The URL of the next page of results is given
+    # in the Link response header, which requests exposes as response.links.
+
+    def paginate(
+        self, response: requests.Response, max_pages: int = None
+    ) -> Iterator[requests.Response]:
+        """Iterates over the pages of a paginated list call.
+
+        For example, to print the name of every pipeline in an organization:
+
+            first_page = buildkite_client.list_pipelines(org_slug)
+            for page in buildkite_client.paginate(first_page):
+                for pipeline in page.json():
+                    print(pipeline["name"])
+
+        Args:
+            response: The response to the first page, as returned by any of the
+                list_* functions.
+
+            max_pages (OPTIONAL): Stop after this many pages, including the
+                first one.
+
+        Returns:
+            Iterator[requests.Response]: The response for each page, starting
+                with the one passed in.
+        """
+        pages = 0
+        while response is not None:
+            yield response
+            pages += 1
+            next_link = response.links.get("next")
+            if next_link is None or (max_pages is not None and pages >= max_pages):
+                return
+            response = self.__send(method="GET", url=next_link["url"])
+
+    def iterate(
+        self, response: requests.Response, max_pages: int = None
+    ) -> Iterator[dict]:
+        """Iterates over the items of every page of a paginated list call.
+
+        Args:
+            response: The response to the first page, as returned by any of the
+                list_* functions.
+
+            max_pages (OPTIONAL): Stop after this many pages, including the
+                first one.
+
+        Returns:
+            Iterator[dict]: Each decoded item, in the order the API lists them.
+
+        Raises:
+            BuildkiteError: If any page could not be fetched.
+        """
+        for page in self.paginate(response, max_pages=max_pages):
+            yield from _json(page)
+
     # Access Token API
     # https://buildkite.com/docs/apis/rest-api/access-token
 
@@ -703,13 +1755,24 @@ class BuildkiteClient:
                     Example: {'pull_request_repository':'git://github.com/my-org/my-repo.git'}
 
         Returns:
-            requests.Response: The response from the API call.
+            requests.Response: The response from the API call. When the client
+                has a coalesce_window, identical calls made close together
+                share a single response.
         """
-        return self.__request(
-            method="POST",
-            path=f"organizations/{org_slug}/pipelines/{pipeline_slug}/builds/{build_number}",
-            params=params,
+
+        def create():
+            return self.__request(
+                method="POST",
+                path=f"organizations/{org_slug}/pipelines/{pipeline_slug}/builds/{build_number}",
+                params=params,
+            )
+
+        if self.__coalesce_window is None:
+            return create()
+        key = json.dumps(
+            [org_slug, pipeline_slug, str(build_number), params], sort_keys=True
         )
+        return self.__coalesced(key, create)
 
     def cancel_build(
         self, org_slug: str, pipeline_slug: str, build_number: str
@@ -849,7 +1912,12 @@ class BuildkiteClient:
         )
 
     def get_job_log(
-        self, org_slug: str, pipeline_slug: str, build_number: str, job_id: str
+        self,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        job_id: str,
+        stream: bool = False,
     ) -> requests.Response:
         """Get a job's log output
         https://buildkite.com/docs/apis/rest-api/jobs#get-a-jobs-log-output
@@ -869,12 +1937,17 @@ class BuildkiteClient:
 
             job_id: All jobs have a unique ID.
 
+            stream (OPTIONAL): Request the raw log as text/plain rather than
+                JSON, and leave it to be read in chunks with iter_content().
+
         Returns:
             requests.Response: The response from the API call.
         """
         return self.__request(
             method="GET",
             path=f"organizations/{org_slug}/pipelines/{pipeline_slug}/builds/{build_number}/jobs/{job_id}/log",
+            headers={"Accept": "text/plain"} if stream else None,
+            stream=stream,
         )
 
     def delete_job_log(
@@ -1133,6 +2206,7 @@ class BuildkiteClient:
         build_number: str,
         job_id: str,
         artifact_id: str,
+        stream: bool = False,
     ) -> requests.Response:
         """Download an artifact
         https://buildkite.com/docs/apis/rest-api/artifacts#download-an-artifact
@@ -1161,12 +2235,16 @@ class BuildkiteClient:
 
             artifact_id: All artifacts have a unique ID.
 
+            stream (OPTIONAL): Leave the artifact to be read in chunks with
+                iter_content(), rather than loading it into memory.
+
         Returns:
             requests.Response: The response from the API call.
         """
         return self.__request(
             method="GET",
             path=f"organizations/{org_slug}/pipelines/{pipeline_slug}/builds/{build_number}/jobs/{job_id}/artifacts/{artifact_id}/download",
+            stream=stream,
         )
 
     def delete_artifact(
@@ -1259,6 +2337,80 @@ class BuildkiteClient:
             path=f"organizations/{org_slug}/pipelines/{pipeline_slug}/builds/{build_number}/annotations",
         )
 
+    # Composite calls
+
+    # These combine several of the calls above, issuing them concurrently so
+    # that they take as long as the slowest call rather than the sum of them.
+
+    def get_build_bundle(
+        self,
+        org_slug: str,
+        pipeline_slug: str,
+        build_number: str,
+        env_job_ids: list = None,
+        params: dict = None,
+    ) -> dict:
+        """Get a build with its annotations and artifacts
+
+        Calls get_build(), list_build_annotations() and list_build_artifacts()
+        concurrently, plus get_job_env_vars() for any jobs given, and returns
+        the decoded results together.
+
+        Args:
+            org_slug: The organization slug is a simplified version of the
+                organisation name. You can find this within the full details of
+                an organization using list_organizations().
+
+            pipeline_slug: The pipeline slug is a simplified version of the
+                pipeline name. You can find this within the full details of a
+                pipeline using list_pipelines().
+
+            build_number: All builds have both an ID which is unique within the
+                whole of Buildkite (build ID), and a sequential number which is
+                unique to the pipeline (build number).
+
+            env_job_ids (OPTIONAL): The IDs of jobs to fetch the environment
+                variables of.
+
+            params (OPTIONAL): Passed on to get_build().
+
+        Returns:
+            dict: The "build", its "annotations" and "artifacts" (every page of
+                them), and the "env" of each requested job, keyed by job ID.
+
+        Raises:
+            BuildkiteError: If any of the calls failed.
+        """
+        executor = self.__get_executor()
+        build = executor.submit(
+            _carry_priority(self.get_build), org_slug, pipeline_slug, build_number, params
+        )
+
+        def every_page(list_call):
+            return list(self.iterate(list_call(org_slug, pipeline_slug, build_number)))
+
+        annotations = executor.submit(_carry_priority(every_page), self.list_build_annotations)
+        artifacts = executor.submit(_carry_priority(every_page), self.list_build_artifacts)
+        env = {
+            job_id: executor.submit(
+                _carry_priority(self.get_job_env_vars),
+                org_slug,
+                pipeline_slug,
+                build_number,
+                job_id,
+            )
+            for job_id in env_job_ids or []
+        }
+        return {
+            "build": _json(build.result()),
+            "annotations": annotations.result(),
+            "artifacts": artifacts.result(),
+            "env": {
+                job_id: _json(response.result()).get("env", {})
+                for job_id, response in env.items()
+            },
+        }
+
     # Emojis API
     # https://buildkite.com/docs/apis/rest-api/emojis
 
@@ -1313,6 +2465,226 @@ class BuildkiteClient:
             path="meta",
         )
 
+    # GraphQL API
+    # https://buildkite.com/docs/apis/graphql-api
+
+    # The GraphQL API can fetch nested data, such as pipelines with their latest
+    # builds and jobs, in a single request. It uses the same API access token,
+    # which needs the GraphQL scope. graphql_api.py maps common queries onto the
+    # structures returned by the REST functions.
+
+    def graphql(self, query: str, variables: dict = None) -> dict:
+        """Runs a GraphQL query and returns its data.
+
+        Args:
+            query: The GraphQL query or mutation.
+
+            variables (OPTIONAL): The values of the query's variables.
+
+        Returns:
+            dict: The "data" of the response.
+
+        Raises:
+            BuildkiteError: If the call failed, or the response has errors.
+        """
+        response = self.__send(
+            method="POST",
+            url=self.__graphql_endpoint,
+            data=json.dumps({"query": query, "variables": variables or {}}),
+        )
+        result = _json(response)
+        if result.get("errors"):
+            messages = "; ".join(error.get("message", "") for error in result["errors"])
+            raise BuildkiteError(f"GraphQL query failed: {messages}")
+        return result["data"]
+
+
+def _takes_org_slug(func) -> bool:
+    """Whether a BuildkiteClient method takes an org_slug as its first argument."""
+    if not callable(func):
+        return False
+    import inspect
+
+    parameters = list(inspect.signature(func).parameters)
+    return parameters[1:2] == ["org_slug"]
+
+
+class BuildkiteMultiOrgClient:
+    """Routes calls to many organizations, each with its own API access token.
+
+    All organizations share one session, and therefore one HTTP connection
+    pool, and one worker pool for fan-out calls, so the number of sockets and
+    threads stays flat as organizations are added. Each distinct token gets a
+    single BuildkiteClient and RateLimitBudget, shared by every organization
+    that uses it.
+
+    Any BuildkiteClient function that takes an org_slug as its first argument
+    can be called directly on this object and is routed to the right token:
+
+        multi_client = BuildkiteMultiOrgClient(
+            {
+                "acme-inc": os.environ["ACME_BUILDKITE_TOKEN"],
+                "acme-labs": os.environ["LABS_BUILDKITE_TOKEN"],
+            }
+        )
+        pipelines = multi_client.list_pipelines("acme-labs").json()
+    """
+
+    def __init__(
+        self,
+        org_tokens: dict,
+        max_workers: int = 8,
+        pool_maxsize: int = None,
+        endpoint: str = "https://api.buildkite.com",
+        adaptive_concurrency: bool = False,
+    ):
+        """
+        Args:
+            org_tokens: A mapping of organization slug to API access token.
+
+            max_workers: The number of threads used by the fan-out helpers.
+
+            pool_maxsize (OPTIONAL): The number of connections kept open to the
+                API. Defaults to max_workers, so every worker has a connection.
+
+            endpoint (OPTIONAL): The base URL of the API.
+
+            adaptive_concurrency: Give every token an AdaptiveConcurrencyLimit,
+                growing up to the size of the connection pool.
+        """
+        from requests.adapters import HTTPAdapter
+
+        self.__session = _get_session_class()()
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize or max_workers)
+        self.__session.mount("https://", adapter)
+        self.__session.mount("http://", adapter)
+        self.__max_workers = max_workers
+        self.__executor = None
+        self.__executor_lock = threading.Lock()
+
+        clients_by_token = {}
+        self.__clients = {}
+        for org_slug, api_access_token in org_tokens.items():
+            if api_access_token not in clients_by_token:
+                clients_by_token[api_access_token] = BuildkiteClient(
+                    api_access_token,
+                    session=self.__session,
+                    budget=RateLimitBudget(),
+                    endpoint=endpoint,
+                    concurrency=AdaptiveConcurrencyLimit(maximum=pool_maxsize or max_workers)
+                    if adaptive_concurrency
+                    else None,
+                )
+            self.__clients[org_slug] = clients_by_token[api_access_token]
+
+    @property
+    def org_slugs(self) -> list:
+        """The slugs of every organization known to this client."""
+        return list(self.__clients)
+
+    def client(self, org_slug: str) -> BuildkiteClient:
+        """Returns the client holding the token for the given organization."""
+        try:
+            return self.__clients[org_slug]
+        except KeyError:
+            raise BuildkiteError(f"No API access token for organization {org_slug}.")
+
+    def __getattr__(self, name: str) -> Callable:
+        if name.startswith("_") or not _takes_org_slug(getattr(BuildkiteClient, name, None)):
+            raise AttributeError(name)
+
+        def routed(org_slug: str, *args, **kwargs):
+            return getattr(self.client(org_slug), name)(org_slug, *args, **kwargs)
+
+        routed.__name__ = name
+        routed.__doc__ = getattr(BuildkiteClient, name).__doc__
+        return routed
+
+    def map_orgs(self, func: Callable, org_slugs: list = None) -> dict:
+        """Calls func(client, org_slug) for many organizations concurrently.
+
+        Args:
+            func: The function to call for each organization.
+
+            org_slugs (OPTIONAL): The organizations to call it for. Defaults to
+                every organization known to this client.
+
+        Returns:
+            dict: The result of each call, keyed by organization slug.
+        """
+        if org_slugs is None:
+            org_slugs = self.org_slugs
+        with self.__executor_lock:
+            if self.__executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.__max_workers,
+                    thread_name_prefix="buildkite-fan-out",
+                )
+        futures = {
+            org_slug: self.__executor.submit(
+                _carry_priority(func), self.client(org_slug), org_slug
+            )
+            for org_slug in org_slugs
+        }
+        return {org_slug: future.result() for org_slug, future in futures.items()}
+
+    def list_builds_across_orgs(
+        self, params: dict = None, org_slugs: list = None, max_pages: int = 1
+    ) -> list:
+        """List builds for many organizations at once
+
+        Calls list_organization_builds() for each organization concurrently and
+        merges the results, newest first, by created_at.
+
+        Args:
+            params (OPTIONAL): The filters passed to list_organization_builds().
+
+            org_slugs (OPTIONAL): The organizations to list builds for. Defaults
+                to every organization known to this client.
+
+            max_pages: The number of pages to fetch for each organization.
+
+        Returns:
+            list: The decoded builds of every organization.
+
+        Raises:
+            BuildkiteError: If the builds of any organization could not be
+                fetched.
+        """
+
+        def list_builds(client, org_slug):
+            first_page = client.list_organization_builds(org_slug, params=params)
+            return list(client.iterate(first_page, max_pages=max_pages))
+
+        builds_by_org = self.map_orgs(list_builds, org_slugs)
+        return list(
+            heapq.merge(
+                *builds_by_org.values(),
+                key=lambda build: build["created_at"],
+                reverse=True,
+            )
+        )
+
+    def close(self):
+        """Shuts down the shared worker pool and closes all connections."""
+        with self.__executor_lock:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+                self.__executor = None
+        self.__session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 if __name__ == "__main__":
-    print("Please import the module to interface with the classes and functions.")
+    import sys
+
+    from cli import main as cli_main
+
+    sys.exit(cli_main())
@@ -0,0 +1,186 @@
+"""Keeps pipelines in line with their definitions, only writing real changes.
+
+sync_pipelines() compares each desired pipeline definition with the pipeline
+that currently exists, by hashing a normalised copy of the fields the
+definition sets, and only calls create_yaml_pipeline() or update_pipeline()
+for pipelines that are missing or different.
+
+The hash of every definition that was applied is kept in a local state file.
+On the next run, definitions whose hash has not changed are skipped without
+even fetching the pipeline; pass force=True to check them all against the API.
+
+    definitions = {
+        "my-pipeline": {
+            "name": "My Pipeline",
+            "repository": "git@github.com:acme-inc/my-pipeline.git",
+            "configuration": "steps:\\n  - command: \\"script/release.sh\\"",
+        },
+    }
+    result = sync_pipelines(buildkite_client, org_slug, definitions, state_path=".pipelines.json")
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from main import BuildkiteClient, BuildkiteError, _json
+
+
+def normalise_definition(definition: dict) -> dict:
+    """Returns a copy of a pipeline definition in a canonical form.
+
+    Line endings and trailing whitespace are removed from the YAML
+    configuration, and surrounding whitespace from every other string, so
+    that cosmetic differences do not count as changes.
+    """
+    normalised = {}
+    for key, value in definition.items():
+        if key == "configuration" and isinstance(value, str):
+            lines = value.replace("\r\n", "\n").split("\n")
+            value = "\n".join(line.rstrip() for line in lines).strip("\n")
+        elif isinstance(value, str):
+            value = value.strip()
+        elif isinstance(value, dict):
+            value = normalise_definition(value)
+        normalised[key] = value
+    return normalised
+
+
+def definition_hash(definition: dict) -> str:
+    """Returns the SHA-256 of a normalised pipeline definition."""
+    canonical = json.dumps(
+        normalise_definition(definition), sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# Fields that create and update take under a different name than get_pipeline()
+# returns them by, as the path to them in its response.
+_RENAMED_FIELDS = {"provider_settings": ("provider", "settings")}
+
+# Fields that are only used when a pipeline is created, and never returned.
+_CREATE_ONLY_FIELDS = {"team_uuids"}
+
+
+def _project(current, desired):
+    """Keeps only the parts of the current pipeline that the definition sets.
+
+    The API returns many fields, and many provider settings, that a
+    definition does not mention; those must not count as differences.
+    """
+    if isinstance(desired, dict) and isinstance(current, dict):
+        return {key: _project(current.get(key), value) for key, value in desired.items()}
+    return current
+
+
+def _comparable(pipeline: dict, definition: dict) -> tuple:
+    """Returns the parts of a pipeline and its definition that can be compared.
+
+    Renamed fields are looked up where get_pipeline() returns them.
+    Create-only fields are left out of both, since they are never returned.
+    Any other field the response does not include counts as missing, so
+    setting it is a change that gets applied.
+
+    Returns:
+        tuple: The projected current pipeline and the desired definition.
+    """
+    current = {}
+    desired = {}
+    for key, value in definition.items():
+        if key in _CREATE_ONLY_FIELDS:
+            continue
+        *parents, name = _RENAMED_FIELDS.get(key, (key,))
+        source = pipeline
+        for parent in parents:
+            source = source.get(parent) if isinstance(source, dict) else None
+        if isinstance(source, dict) and name in source:
+            current[key] = _project(source[name], value)
+        else:
+            current[key] = None
+        desired[key] = value
+    return current, desired
+
+
+def sync_pipelines(
+    client: BuildkiteClient,
+    org_slug: str,
+    definitions: dict,
+    state_path: str = None,
+    max_workers: int = 8,
+    force: bool = False,
+    dry_run: bool = False,
+) -> dict:
+    """Creates or updates the pipelines that differ from their definitions.
+
+    Args:
+        client: The client to call the Pipelines API with.
+
+        org_slug: The organization slug is a simplified version of the
+            organisation name. You can find this within the full details of
+            an organization using list_organizations().
+
+        definitions: The desired pipeline definitions, keyed by pipeline slug,
+            in the format taken by create_yaml_pipeline().
+
+        state_path (OPTIONAL): A JSON file to keep the hashes of applied
+            definitions in between runs.
+
+        max_workers: The number of pipelines fetched or written concurrently.
+
+        force: Fetch and compare every pipeline, even if its definition has
+            not changed since it was last applied.
+
+        dry_run: Work out what would change without writing anything.
+
+    Returns:
+        dict: The pipeline slugs that were "created", "updated", "unchanged"
+            or "skipped" (unchanged since the last run, not fetched), and a
+            "failed" mapping of pipeline slug to error message.
+    """
+    state = {}
+    if state_path is not None and os.path.exists(state_path):
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+
+    result = {"created": [], "updated": [], "unchanged": [], "skipped": [], "failed": {}}
+    hashes = {slug: definition_hash(definition) for slug, definition in definitions.items()}
+    pending = []
+    for pipeline_slug, digest in hashes.items():
+        if not force and state.get(f"{org_slug}/{pipeline_slug}") == digest:
+            result["skipped"].append(pipeline_slug)
+        else:
+            pending.append(pipeline_slug)
+
+    def sync(pipeline_slug):
+        definition = definitions[pipeline_slug]
+        response = client.get_pipeline(org_slug, pipeline_slug)
+        if response.status_code == 404:
+            if not dry_run:
+                _json(client.create_yaml_pipeline(org_slug, definition))
+            return "created"
+        current, desired = _comparable(_json(response), definition)
+        if definition_hash(current) == definition_hash(desired):
+            return "unchanged"
+        if not dry_run:
+            _json(client.update_pipeline(org_slug, pipeline_slug, definition))
+        return "updated"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {slug: executor.submit(sync, slug) for slug in pending}
+        for pipeline_slug, future in futures.items():
+            try:
+                outcome = future.result()
+            except (BuildkiteError, requests.RequestException) as error:
+                result["failed"][pipeline_slug] = str(error)
+                continue
+            result[outcome].append(pipeline_slug)
+            # Only definitions that were applied, or found to match, are
+            # recorded; a dry run writes no state.
+            state[f"{org_slug}/{pipeline_slug}"] = hashes[pipeline_slug]
+
+    if state_path is not None and not dry_run:
+        with open(state_path, "w") as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+    return result
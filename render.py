@@ -0,0 +1,323 @@
+"""Renders emojis in step names, and job logs with their ANSI colours, to HTML or text.
+
+EmojiTable compiles an organization's emojis, from list_emojis(), into a
+single dictionary of names and aliases, so replacing :name: in a string is
+one regex pass with a dictionary lookup per match:
+
+    emojis = EmojiTable.from_client(buildkite_client, org_slug)
+    emojis.html(":docker: Build image")
+
+LogRenderer turns a job log into HTML, or into plain text, incrementally.
+Bytes are fed in as they arrive, and whole lines come out, so a log of any
+size is rendered in one pass with memory bounded by the longest line:
+
+    for html in render_job_log(buildkite_client, org_slug, "app", "42", job_id, emojis=emojis):
+        response.write(html)
+
+In HTML, colours and styles become <span class="term-fg31 term-bold">
+elements, every line becomes a <div class="line">, with a data-timestamp of
+the Buildkite timestamp marker at its start, and log groups ("--- name",
+"+++ name" and "~~~ name" lines) become <details> elements with the group
+name, emojis included, as their <summary>. A "^^^ +++" line asks for the
+current group to be expanded; since the group has already been written, it
+is rendered as <span class="group-expand"></span> for the page to act on.
+"""
+import codecs
+import html
+import re
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+from main import BuildkiteClient, _json
+
+EMOJI_PATTERN = re.compile(r":([\w+-]+):")
+
+# A CSI sequence (colours, cursor movement), a Buildkite timestamp or other
+# APC sequence (ESC _ ... BEL), or an OSC sequence (ESC ] ... BEL or ST).
+_ESCAPE = re.compile(
+    r"\x1b\[([0-?]*)[ -/]*([@-~])|\x1b_([^\x07]*)\x07|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"
+)
+_LEADING_TIMESTAMP = re.compile(r"\x1b_bk;t=(\d+)\x07")
+_GROUP = re.compile(r"^(---|\+\+\+|~~~) (.*)$")
+_MAYBE_MARKER = "-+~^\x1b"
+_EXPAND_PREVIOUS = "^^^ +++"
+
+_STYLE_CODES = {
+    1: "term-bold", 2: "term-dim", 3: "term-italic", 4: "term-underline", 9: "term-strike",
+}
+_STYLE_RESETS = {
+    22: ("term-bold", "term-dim"), 23: ("term-italic",), 24: ("term-underline",), 29: ("term-strike",),
+}
+
+
+class EmojiTable:
+    """The emojis of an organization, by name and alias."""
+
+    def __init__(self, emojis: list):
+        """
+        Args:
+            emojis: The decoded response of list_emojis().
+        """
+        self.urls = {}
+        for emoji in emojis:
+            self.urls[emoji["name"]] = emoji["url"]
+            for alias in emoji.get("aliases") or []:
+                self.urls.setdefault(alias, emoji["url"])
+        self.__tags = {
+            name: f'<img class="emoji" title="{name}" alt=":{name}:" src="{html.escape(url)}">'
+            for name, url in self.urls.items()
+        }
+
+    @classmethod
+    def from_client(cls, client: BuildkiteClient, org_slug: str) -> "EmojiTable":
+        return cls(_json(client.list_emojis(org_slug)))
+
+    def html(self, text: str, escape: bool = True) -> str:
+        """Returns text as HTML, with known :emoji: names replaced by images.
+
+        Args:
+            text: The text, for example a step name.
+
+            escape: HTML-escape text first. Pass False if it already is.
+        """
+        if escape:
+            text = html.escape(text)
+        if ":" not in text:
+            return text
+        tags = self.__tags
+        return EMOJI_PATTERN.sub(lambda match: tags.get(match[1], match[0]), text)
+
+
+class LogRenderer:
+    """Renders a job log incrementally, one complete line at a time."""
+
+    def __init__(
+        self,
+        html: bool = True,
+        emojis: EmojiTable = None,
+        timestamps: bool = False,
+        max_line: int = 1 << 20,
+    ):
+        """
+        Args:
+            html: Render HTML; otherwise render plain text, without escape
+                sequences.
+
+            emojis (OPTIONAL): The emojis to render in group names, in HTML.
+
+            timestamps: In plain text, start every line that has a Buildkite
+                timestamp marker with the time, in ISO 8601.
+
+            max_line: Lines longer than this many characters are split, to
+                bound memory on logs without newlines.
+        """
+        self.__html = html
+        self.__emojis = emojis
+        self.__timestamps = timestamps
+        self.__max_line = max_line
+        self.__decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.__pending = ""
+        self.__classes = ()
+        self.__transitions = {}
+        self.__in_group = False
+
+    def feed(self, data: bytes) -> str:
+        """Adds a block of the log, and returns the rendering of the lines it completed."""
+        text = self.__pending + self.__decoder.decode(data)
+        lines = text.split("\n")
+        self.__pending = lines.pop()
+        if len(self.__pending) > self.__max_line:
+            # Keep any escape sequence the cut would split in the pending part.
+            cut = self.__pending.rfind("\x1b", len(self.__pending) - 64)
+            if cut == -1:
+                cut = len(self.__pending)
+            lines.append(self.__pending[:cut])
+            self.__pending = self.__pending[cut:]
+        return "".join(self.__render_line(line) for line in lines)
+
+    def close(self) -> str:
+        """Returns the rendering of the rest of the log, and closes any open group."""
+        text = self.__pending + self.__decoder.decode(b"", final=True)
+        self.__pending = ""
+        output = self.__render_line(text) if text else ""
+        if self.__html and self.__in_group:
+            output += "</details>"
+            self.__in_group = False
+        return output
+
+    def __render_line(self, line: str) -> str:
+        if line.endswith("\r"):
+            line = line[:-1]
+        if "\r" in line:
+            # Progress bars redraw a line with \r; keep what was drawn last.
+            line = line.rsplit("\r", 1)[1]
+
+        timestamp = None
+        match = _LEADING_TIMESTAMP.match(line)
+        if match is not None:
+            timestamp = int(match[1])
+            line = line[match.end() :]
+
+        if not self.__html:
+            plain = _ESCAPE.sub("", line) if "\x1b" in line else line
+            if self.__timestamps and timestamp is not None:
+                moment = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+                return f"[{moment.isoformat(timespec='milliseconds')}] {plain}\n"
+            return plain + "\n"
+
+        attributes = ' class="line"'
+        if timestamp is not None:
+            attributes += f' data-timestamp="{timestamp}"'
+        if line[:1] in _MAYBE_MARKER and line:
+            # Only lines that could be a group marker are checked for one.
+            plain = _ESCAPE.sub("", line) if "\x1b" in line else line
+            group = _GROUP.match(plain)
+            if group is not None:
+                name = html.escape(group[2])
+                if self.__emojis is not None:
+                    name = self.__emojis.html(name, escape=False)
+                prefix = "</details>" if self.__in_group else ""
+                self.__in_group = True
+                expanded = " open" if group[1] == "+++" else ""
+                return (
+                    f'{prefix}<details class="group"{expanded}>'
+                    f"<summary{attributes}>{name}</summary>"
+                )
+            if plain == _EXPAND_PREVIOUS:
+                return '<span class="group-expand"></span>'
+        return f"<div{attributes}>{self.__html_line(line)}</div>"
+
+    def __html_line(self, line: str) -> str:
+        # HTML escaping leaves ESC and BEL alone, so escape sequences can
+        # still be found after the whole line is escaped at once.
+        line = html.escape(line, quote=False)
+        if "\x1b" not in line:
+            if self.__classes:
+                return f'<span class="{" ".join(self.__classes)}">{line}</span>'
+            return line
+        parts = []
+        if self.__classes:
+            parts.append(f'<span class="{" ".join(self.__classes)}">')
+        position = 0
+        for match in _ESCAPE.finditer(line):
+            parts.append(line[position : match.start()])
+            position = match.end()
+            if match[2] == "m":
+                if self.__classes:
+                    parts.append("</span>")
+                self.__classes = self.__next_classes(self.__classes, match[1])
+                if self.__classes:
+                    parts.append(f'<span class="{" ".join(self.__classes)}">')
+        parts.append(line[position:])
+        if self.__classes:
+            parts.append("</span>")
+        return "".join(parts)
+
+    def __next_classes(self, classes: tuple, parameters: str) -> tuple:
+        """Returns the classes after an SGR sequence, from a cache of transitions."""
+        key = (classes, parameters)
+        result = self.__transitions.get(key)
+        if result is None:
+            result = self.__transitions[key] = _apply_sgr(classes, parameters)
+        return result
+
+
+def _apply_sgr(classes: tuple, parameters: str) -> tuple:
+    """Returns the classes after applying the parameters of an SGR sequence."""
+    codes = [int(code) if code.isdigit() else 0 for code in parameters.split(";")]
+    classes = list(classes)
+    index = 0
+    while index < len(codes):
+        code = codes[index]
+        if code == 0:
+            classes.clear()
+        elif code in _STYLE_CODES:
+            if _STYLE_CODES[code] not in classes:
+                classes.append(_STYLE_CODES[code])
+        elif code in _STYLE_RESETS:
+            classes = [name for name in classes if name not in _STYLE_RESETS[code]]
+        elif 30 <= code <= 37 or 90 <= code <= 97 or code == 39:
+            classes = [name for name in classes if not name.startswith("term-fg")]
+            if code != 39:
+                classes.append(f"term-fg{code}")
+        elif 40 <= code <= 47 or 100 <= code <= 107 or code == 49:
+            classes = [name for name in classes if not name.startswith("term-bg")]
+            if code != 49:
+                classes.append(f"term-bg{code}")
+        elif code in (38, 48) and index + 2 < len(codes) and codes[index + 1] == 5:
+            # 256-colour palette: 38;5;n or 48;5;n.
+            kind = "fg" if code == 38 else "bg"
+            classes = [name for name in classes if not name.startswith(f"term-{kind}")]
+            classes.append(f"term-{kind}x{codes[index + 2]}")
+            index += 2
+        elif code in (38, 48) and index + 1 < len(codes) and codes[index + 1] == 2:
+            # True colour (38;2;r;g;b) has no class; it is dropped.
+            index += 4
+        index += 1
+    return tuple(classes)
+
+
+def render_log(stream: Iterable, **options) -> Iterator[str]:
+    """Renders a log, given as bytes or an iterable of byte blocks.
+
+    Args:
+        stream: The log.
+
+        options: Passed on to LogRenderer.
+
+    Returns:
+        Iterator: Rendered HTML or text, a block of lines at a time.
+    """
+    if isinstance(stream, bytes):
+        stream = [stream]
+    renderer = LogRenderer(**options)
+    for block in stream:
+        output = renderer.feed(block)
+        if output:
+            yield output
+    output = renderer.close()
+    if output:
+        yield output
+
+
+def render_job_log(
+    client: BuildkiteClient,
+    org_slug: str,
+    pipeline_slug: str,
+    build_number: str,
+    job_id: str,
+    chunk_size: int = 1 << 16,
+    **options,
+) -> Iterator[str]:
+    """Streams a job's log from the API and renders it as it arrives.
+
+    Args:
+        client: The client to fetch the log with.
+
+        org_slug: The organization slug is a simplified version of the
+            organisation name. You can find this within the full details of
+            an organization using list_organizations().
+
+        pipeline_slug: The pipeline slug is a simplified version of the
+            pipeline name. You can find this within the full details of a
+            pipeline using list_pipelines().
+
+        build_number: The number of the build the job belongs to.
+
+        job_id: All jobs have a unique ID.
+
+        chunk_size: How many bytes to read from the connection at a time.
+
+        options: Passed on to LogRenderer.
+
+    Returns:
+        Iterator: Rendered HTML or text, a block of lines at a time.
+
+    Raises:
+        BuildkiteError: If the log could not be fetched.
+    """
+    response = client.get_job_log(org_slug, pipeline_slug, build_number, job_id, stream=True)
+    if not response.ok:
+        _json(response)
+    with response:
+        yield from render_log(response.iter_content(chunk_size=chunk_size), **options)
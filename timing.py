@@ -0,0 +1,127 @@
+"""A detailed timing breakdown of every request.
+
+TimingAdapter is a transport adapter whose connections time each phase of a
+request, and attach the result to the response as response.timing, a dict of
+durations in seconds:
+
+- "dns": resolving the host name, "connect": opening the TCP connection, and
+  "tls": the TLS handshake. All three are None when the connection was
+  "reused" from the pool.
+- "ttfb": from the request being sent to the response headers arriving,
+  which is mostly time spent by the server.
+- "transfer": reading the body. None for streamed responses, whose body is
+  read later by the caller.
+
+    buildkite_client = BuildkiteClient(buildkite_token, detailed_timing=True)
+    buildkite_client.add_listener(lambda event, details: print(details.get("timing")))
+
+The timings are also included in the client's "request" instrumentation
+events.
+"""
+import socket
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError
+from urllib3.util.connection import allowed_gai_family
+
+
+class _TimedConnectionMixin:
+    """Times connection setup, and the wait for each response."""
+
+    _setup_timing = None
+    _sent_at = None
+
+    def _new_conn(self):
+        host = self._dns_host
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror as error:
+            raise NameResolutionError(self.host, self, error) from error
+        resolved = time.perf_counter()
+
+        # Connect to the resolved addresses in turn, so that the name is not
+        # resolved a second time.
+        last_error = None
+        for *_, address in addresses:
+            self._dns_host = address[0]
+            try:
+                sock = super()._new_conn()
+                break
+            except OSError as error:
+                last_error = error
+            finally:
+                self._dns_host = host
+        else:
+            raise last_error
+
+        self._setup_timing = {
+            "dns": resolved - started,
+            "connect": time.perf_counter() - resolved,
+            "tls": None,
+        }
+        return sock
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        if isinstance(self, HTTPSConnection) and self._setup_timing is not None:
+            setup = self._setup_timing
+            setup["tls"] = time.perf_counter() - started - setup["dns"] - setup["connect"]
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        self._sent_at = time.perf_counter()
+
+    def getresponse(self):
+        response = super().getresponse()
+        setup, self._setup_timing = self._setup_timing, None
+        response.timing = {
+            "dns": setup and setup["dns"],
+            "connect": setup and setup["connect"],
+            "tls": setup and setup["tls"],
+            "ttfb": time.perf_counter() - self._sent_at,
+            "transfer": None,
+            "reused": setup is None,
+        }
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimingAdapter(HTTPAdapter):
+    """An HTTPAdapter that records a timing breakdown of every request."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, stream=False, **kwargs):
+        response = super().send(request, stream=stream, **kwargs)
+        timing = getattr(response.raw, "timing", None)
+        if timing is not None and not stream:
+            started = time.perf_counter()
+            response.content
+            timing["transfer"] = time.perf_counter() - started
+        response.timing = timing
+        return response
@@ -0,0 +1,421 @@
+"""Receives Buildkite webhooks and keeps a local view of builds, jobs and agents.
+
+Buildkite can notify a URL whenever a build, job or agent changes state:
+https://buildkite.com/docs/apis/webhooks
+
+Rather than polling get_build() and list_agents(), point a webhook at a
+BuildkiteWebhookReceiver and read from its BuildkiteState. The API is only
+called when the events show that something was missed.
+
+    state = BuildkiteState(client=buildkite_client)
+    state.watch("build.finished", lambda event, payload: print(payload["build"]["number"]))
+
+    receiver = BuildkiteWebhookReceiver(state, token=os.environ["WEBHOOK_TOKEN"])
+    receiver.serve(port=8080)
+"""
+import fnmatch
+import hashlib
+import hmac
+import json
+import logging
+import re
+import threading
+import time
+from typing import Callable, Iterable
+
+import requests
+
+from main import BuildkiteClient, BuildkiteError, _json
+
+logger = logging.getLogger(__name__)
+
+# Build, job and agent API URLs embed the organization and pipeline slugs.
+_BUILD_URL = re.compile(
+    r"/organizations/(?P<org>[^/]+)/pipelines/(?P<pipeline>[^/]+)/builds/(?P<number>\d+)"
+)
+_ORG_URL = re.compile(r"/organizations/(?P<org>[^/]+)")
+
+# Builds in these states will not change again, so older events are ignored.
+FINISHED_BUILD_STATES = {"passed", "failed", "canceled", "skipped", "not_run"}
+
+
+class BuildkiteState:
+    """An in-memory view of builds, jobs and agents built from webhook events.
+
+    Builds are keyed by (org_slug, pipeline_slug, build_number), jobs and
+    agents by their IDs. When a client is given, gaps in the event stream are
+    filled in by polling: a job event for a build that has never been seen, or
+    a build number that skips ahead of the last one seen for its pipeline,
+    fetches the missing builds with get_build(). They are fetched one at a
+    time on a background thread, so deliveries are acknowledged without
+    waiting for the API; failures are logged. Call close() to wait for the
+    fills still pending.
+    """
+
+    def __init__(self, client: BuildkiteClient = None, max_gap: int = 50):
+        """
+        Args:
+            client (OPTIONAL): The client used to fill in gaps in the events.
+                Without one, gaps are only logged.
+
+            max_gap: The most missed builds of a pipeline to fetch for one
+                event. Only the latest are fetched from a larger gap, and the
+                older ones are logged.
+        """
+        self.__client = client
+        self.__max_gap = max_gap
+        self.__lock = threading.RLock()
+        self.__filler = None
+        self.__watchers = []
+        self.builds = {}
+        self.jobs = {}
+        self.agents = {}
+        self.last_build_numbers = {}
+        self.last_event_at = None
+
+    def watch(self, pattern: str, callback: Callable):
+        """Calls callback(event, payload) for every event matching pattern.
+
+        Args:
+            pattern: An event name, or a shell-style pattern such as "job.*".
+
+            callback: The function to call after the event has been applied.
+        """
+        with self.__lock:
+            self.__watchers.append((pattern, callback))
+
+    def get_build(self, org_slug: str, pipeline_slug: str, build_number) -> dict:
+        """Returns the latest known state of a build, or None."""
+        with self.__lock:
+            return self.builds.get((org_slug, pipeline_slug, int(build_number)))
+
+    def list_agents(self, org_slug: str = None) -> list:
+        """Returns the latest known state of every connected agent."""
+        with self.__lock:
+            return [
+                agent
+                for agent in self.agents.values()
+                if org_slug is None or _org_slug(agent) == org_slug
+            ]
+
+    def is_stale(self, max_age: float) -> bool:
+        """Whether no event has been received in the last max_age seconds."""
+        return self.last_event_at is None or time.time() - self.last_event_at > max_age
+
+    def resync_agents(self, org_slug: str):
+        """Replaces the known agents of an organization by polling list_agents().
+
+        Useful at startup, or when is_stale() suggests deliveries were lost.
+        """
+        if self.__client is None:
+            raise BuildkiteError("BuildkiteState.resync_agents: no client was given.")
+        agents = list(self.__client.iterate(self.__client.list_agents(org_slug)))
+        with self.__lock:
+            for agent_id, agent in list(self.agents.items()):
+                if _org_slug(agent) == org_slug:
+                    del self.agents[agent_id]
+            for agent in agents:
+                self.agents[agent["id"]] = agent
+
+    def close(self):
+        """Waits for the pending gap fills, and stops the background thread."""
+        with self.__lock:
+            filler, self.__filler = self.__filler, None
+        if filler is not None:
+            filler.shutdown()
+
+    def apply(self, payload: dict):
+        """Applies one webhook payload to the state and notifies watchers.
+
+        Args:
+            payload: The decoded webhook body. Its "event" key names the event,
+                for example "build.started", "job.finished" or
+                "agent.disconnected".
+        """
+        event = payload.get("event", "")
+        gaps = []
+        with self.__lock:
+            self.last_event_at = time.time()
+            if "build" in payload:
+                gaps = self.__apply_build(payload["build"], from_job=event.startswith("job."))
+            if event.startswith("job.") and "job" in payload:
+                self.jobs[payload["job"]["id"]] = payload["job"]
+                build = self.builds.get(_build_key(payload.get("build", {})))
+                if build is not None:
+                    _replace_job(build, payload["job"])
+            if event.startswith("agent.") and "agent" in payload:
+                agent = payload["agent"]
+                if event in ("agent.disconnected", "agent.lost", "agent.stopped"):
+                    self.agents.pop(agent["id"], None)
+                else:
+                    self.agents[agent["id"]] = agent
+            watchers = list(self.__watchers)
+            if gaps and self.__client is not None and self.__filler is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.__filler = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="buildkite-gap-fill"
+                )
+            filler = self.__filler
+
+        for org_slug, pipeline_slug, build_numbers in gaps:
+            if filler is None:
+                self.__fill_gap(org_slug, pipeline_slug, build_numbers)
+            else:
+                filler.submit(self.__fill_gap, org_slug, pipeline_slug, build_numbers)
+        for pattern, callback in watchers:
+            if fnmatch.fnmatchcase(event, pattern):
+                callback(event, payload)
+
+    def __apply_build(self, build: dict, from_job: bool) -> list:
+        """Applies a build from an event, and returns the gaps it revealed.
+
+        Returns:
+            list: (org_slug, pipeline_slug, build_numbers) of builds to fetch.
+        """
+        key = _build_key(build)
+        if key is None:
+            return []
+        org_slug, pipeline_slug, number = key
+        known = self.builds.get(key)
+
+        # Job events carry a build too, but without a stored build the jobs
+        # list would be incomplete, so fetch the whole build instead.
+        if known is None and from_job:
+            return [(org_slug, pipeline_slug, [number])]
+
+        # Never let a late delivery move a finished build back to running.
+        if known is not None and known.get("state") in FINISHED_BUILD_STATES:
+            if build.get("state") not in FINISHED_BUILD_STATES:
+                return []
+
+        if known is not None and "jobs" not in build:
+            build = {**build, "jobs": known.get("jobs", [])}
+        self.builds[key] = build
+
+        gaps = []
+        last_number = self.last_build_numbers.get((org_slug, pipeline_slug))
+        if last_number is not None and number > last_number + 1:
+            missed = list(range(last_number + 1, number))
+            if len(missed) > self.__max_gap:
+                logger.warning(
+                    "Missed events for %s/%s builds %s to %s, which are not fetched.",
+                    org_slug,
+                    pipeline_slug,
+                    missed[0],
+                    missed[-1 - self.__max_gap],
+                )
+                missed = missed[len(missed) - self.__max_gap :]
+            if missed:
+                gaps.append((org_slug, pipeline_slug, missed))
+        if last_number is None or number > last_number:
+            self.last_build_numbers[(org_slug, pipeline_slug)] = number
+        return gaps
+
+    def __fill_gap(self, org_slug: str, pipeline_slug: str, build_numbers: list):
+        """Fetches missed builds, on the background thread if there is a client."""
+        if self.__client is None:
+            logger.warning(
+                "Missed events for %s/%s builds %s.", org_slug, pipeline_slug, build_numbers
+            )
+            return
+        for number in build_numbers:
+            try:
+                response = self.__client.get_build(org_slug, pipeline_slug, str(number))
+                if response.status_code == 404:
+                    continue
+                build = _json(response)
+            except (BuildkiteError, requests.RequestException) as error:
+                logger.warning(
+                    "Could not fetch missed build %s/%s#%s: %s",
+                    org_slug,
+                    pipeline_slug,
+                    number,
+                    error,
+                )
+                continue
+            key = (org_slug, pipeline_slug, number)
+            with self.__lock:
+                # An event may have delivered the build while it was fetched.
+                known = self.builds.get(key)
+                if known is None or (
+                    build.get("state") in FINISHED_BUILD_STATES
+                    and known.get("state") not in FINISHED_BUILD_STATES
+                ):
+                    self.builds[key] = build
+
+
+class BuildkiteWebhookReceiver:
+    """Validates webhook deliveries and applies them to a BuildkiteState.
+
+    The receiver is a WSGI application, has an ASGI entry point in asgi(), and
+    can run standalone with serve(). Deliveries are authenticated with either
+    the webhook token (X-Buildkite-Token) or the HMAC signature
+    (X-Buildkite-Signature), depending on which of the two is configured.
+    """
+
+    def __init__(
+        self,
+        state: BuildkiteState,
+        token: str = None,
+        secret: str = None,
+        tolerance: int = 300,
+        record_to: str = None,
+    ):
+        """
+        Args:
+            state: The state that accepted events are applied to.
+
+            token (OPTIONAL): The webhook token set on the notification service.
+
+            secret (OPTIONAL): The secret used to sign webhook payloads.
+
+            tolerance: How old, in seconds, a signed delivery may be before it
+                is rejected as a replay.
+
+            record_to (OPTIONAL): A file that every accepted delivery is
+                appended to as a JSON line, for replay() later on.
+        """
+        if token is None and secret is None:
+            raise ValueError("BuildkiteWebhookReceiver: a token or secret is required.")
+        self.state = state
+        self.__token = token
+        self.__secret = secret
+        self.__tolerance = tolerance
+        self.__record_to = record_to
+        self.__record_lock = threading.Lock()
+
+    def verify(self, headers: dict, body: bytes) -> bool:
+        """Checks that a delivery was sent by Buildkite.
+
+        Args:
+            headers: The request headers. Names are matched case-insensitively.
+
+            body: The raw request body.
+        """
+        headers = {name.lower(): value for name, value in headers.items()}
+        if self.__secret is not None:
+            parts = dict(
+                part.split("=", 1)
+                for part in headers.get("x-buildkite-signature", "").split(",")
+                if "=" in part
+            )
+            if "timestamp" not in parts or "signature" not in parts:
+                return False
+            try:
+                timestamp = int(parts["timestamp"])
+            except ValueError:
+                return False
+            if abs(time.time() - timestamp) > self.__tolerance:
+                return False
+            expected = hmac.new(
+                self.__secret.encode(),
+                parts["timestamp"].encode() + b"." + body,
+                hashlib.sha256,
+            ).hexdigest()
+            return hmac.compare_digest(expected, parts["signature"])
+        return hmac.compare_digest(
+            headers.get("x-buildkite-token", "").encode(), self.__token.encode()
+        )
+
+    def handle(self, headers: dict, body: bytes) -> tuple:
+        """Verifies, decodes and applies a single delivery.
+
+        Returns:
+            tuple: The HTTP status code and message to respond with.
+        """
+        if not self.verify(headers, body):
+            return 401, "Unauthorized"
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, "Invalid JSON"
+        if self.__record_to is not None:
+            with self.__record_lock, open(self.__record_to, "a") as record:
+                record.write(json.dumps(payload) + "\n")
+        self.state.apply(payload)
+        return 200, "OK"
+
+    def replay(self, payloads: Iterable):
+        """Applies recorded payloads without authentication.
+
+        Args:
+            payloads: Decoded payloads, or the path of a file written with
+                record_to.
+        """
+        if isinstance(payloads, str):
+            with open(payloads) as record:
+                payloads = [json.loads(line) for line in record if line.strip()]
+        for payload in payloads:
+            self.state.apply(payload)
+
+    def __call__(self, environ: dict, start_response: Callable):
+        if environ["REQUEST_METHOD"] != "POST":
+            status, message = 405, "Method Not Allowed"
+        else:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            body = environ["wsgi.input"].read(length)
+            headers = {
+                name[5:].replace("_", "-"): value
+                for name, value in environ.items()
+                if name.startswith("HTTP_")
+            }
+            status, message = self.handle(headers, body)
+        start_response(f"{status} {message}", [("Content-Type", "text/plain")])
+        return [message.encode()]
+
+    async def asgi(self, scope: dict, receive: Callable, send: Callable):
+        """The ASGI entry point, for example uvicorn.run(receiver.asgi)."""
+        if scope["type"] != "http":
+            return
+        if scope["method"] != "POST":
+            status, message = 405, "Method Not Allowed"
+        else:
+            body = b""
+            while True:
+                event = await receive()
+                body += event.get("body", b"")
+                if not event.get("more_body"):
+                    break
+            headers = {name.decode(): value.decode() for name, value in scope["headers"]}
+            status, message = self.handle(headers, body)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        await send({"type": "http.response.body", "body": message.encode()})
+
+    def serve(self, host: str = "0.0.0.0", port: int = 8080):
+        """Runs the receiver in a standalone HTTP server until interrupted."""
+        from socketserver import ThreadingMixIn
+        from wsgiref.simple_server import WSGIServer, make_server
+
+        class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+            daemon_threads = True
+
+        with make_server(host, port, self, server_class=ThreadingWSGIServer) as server:
+            server.serve_forever()
+
+
+def _build_key(build: dict) -> tuple:
+    match = _BUILD_URL.search(build.get("url", ""))
+    if match is None:
+        return None
+    return match["org"], match["pipeline"], int(match["number"])
+
+
+def _org_slug(resource: dict) -> str:
+    match = _ORG_URL.search(resource.get("url", ""))
+    return match["org"] if match else None
+
+
+def _replace_job(build: dict, job: dict):
+    jobs = build.setdefault("jobs", [])
+    for index, known in enumerate(jobs):
+        if known.get("id") == job["id"]:
+            jobs[index] = job
+            return
+    jobs.append(job)